@@ -6,6 +6,7 @@ from . import template
 from . import feedback as fdback
 from . import auth as abcauth
 from . import git as abcgit
+from . import scrub_feedback as abcscrub
 
 
 from .quickstart import create_dir_struct
@@ -50,7 +51,7 @@ def init():
         """
     )
     try:
-        abcgit.check_git_ssh()
+        abcgit.check_git_ssh(force=True)
         print(
             """Running git commands that access GitHub via SSH seems to
         be configured correctly"""
@@ -89,6 +90,49 @@ def clone():
         action="store_false",
         help="""Skip moving files from cloned repo to submitted.""",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="""Number of repositories to clone or pull at the same time
+        (default = 1).""",
+    )
+    parser.add_argument(
+        "--strategy",
+        choices=abcgit.CLONE_STRATEGIES,
+        default=None,
+        help="""How much of each new repository to download: full = all
+        history; shallow = latest commit only; blobless = file contents
+        only when checked out; sparse = only check out files_to_grade
+        (Default = clone_strategy in config.yml, or full).""",
+    )
+    parser.add_argument(
+        "--reference",
+        choices=["none", "template", "cache"],
+        default=None,
+        help="""Store git objects shared with the assignment template only
+        once: template = borrow them from the local template repository;
+        cache = borrow them from a mirror of the template repository on
+        GitHub, kept in clone_dir (Default = clone_reference in config.yml,
+        or none).""",
+    )
+    parser.add_argument(
+        "--from-git",
+        action="store_true",
+        help="""Copy files to submitted from the latest commit in each
+        repository (read directly from git) rather than from the files in
+        the working tree.""",
+    )
+    parser.add_argument(
+        "--skip-missing",
+        action="store_true",
+        default=None,
+        help="""Do not run git for students whose repository is not listed
+        in the GitHub organization. Needs the abc-classroom-bot GitHub App
+        to have access to all repositories in the organization (Default =
+        skip_missing_repos in config.yml, or false).""",
+    )
     args = parser.parse_args()
 
     clone_student_repos(args)
@@ -118,10 +162,43 @@ def feedback():
         action="store_true",
         help="""Cleans out hidden tests from notebooks when used.""",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="""Number of pushes to GitHub to run at the same time
+        (default = 1).""",
+    )
     args = parser.parse_args()
     fdback.copy_feedback(args)
 
 
+def scrub():
+    """
+    Removes hidden tests from all of the html feedback reports for an
+    assignment, i.e. the files in course_materials/feedback/student/assignment.
+    Reports are scrubbed in parallel, and reports that have already been
+    scrubbed are skipped.
+    """
+    parser = argparse.ArgumentParser(description=scrub.__doc__)
+    parser.add_argument(
+        "assignment",
+        help="""Name of assignment. Must match name in course_materials
+        feedback directory""",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="""Number of reports to scrub at the same time (default =
+        number of CPUs).""",
+    )
+    args = parser.parse_args()
+    abcscrub.scrub_assignment(args.assignment, args.jobs)
+
+
 def new_template():
     """
     Create a new assignment template repository: creates local directory,
@@ -132,9 +209,25 @@ def new_template():
     parser = argparse.ArgumentParser(description=new_template.__doc__)
     parser.add_argument(
         "assignment",
+        nargs="?",
         help="""Name of assignment. Must match name in
         course_materials/release directory""",
     )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="""Create templates for every assignment in the
+        course_materials/release directory, instead of a single
+        assignment.""",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="""With --all, the number of templates to create at the same
+        time (default = 1).""",
+    )
     parser.add_argument(
         "--commit-message",
         default="Initial commit",
@@ -150,14 +243,17 @@ def new_template():
     )
     parser.add_argument(
         "--mode",
-        choices=["delete", "fail", "merge"],
+        choices=["delete", "fail", "merge", "sync"],
         default="fail",
         help="""Action if template directory already exists. Choices are:
         delete = delete contents before proceeding (except .git directory);
-        merge = keep existing dir, overwrite existing files, add new files
-        (Default = fail).""",
+        merge = keep existing dir, overwrite existing files, add new files;
+        sync = only copy new and changed files, and remove files that are
+        no longer in the assignment (Default = fail).""",
     )
     args = parser.parse_args()
+    if args.all == (args.assignment is not None):
+        parser.error("give either an assignment name or --all")
     template.new_update_template(args)
 
 
@@ -211,12 +307,13 @@ def update_template():
     )
     parser.add_argument(
         "--mode",
-        choices=["delete", "merge"],
+        choices=["delete", "merge", "sync"],
         default="merge",
         help="""What to do with existing contents of template directory.
         Choices are: delete = remove contents before proceeding (leaving .git
-        directory); merge = overwrite existing files add new files
-        (Default = merge).""",
+        directory); merge = overwrite existing files add new files; sync =
+        only copy new and changed files, and remove files that are no longer
+        in the assignment (Default = merge).""",
     )
     parser.add_argument(
         "--commit-message",
@@ -6,12 +6,10 @@ abc-classroom.auth
 # Methods for setting up authorization to the GitHub API. See
 # github.py for methods that use the API.
 
-import requests
-
 import os.path as op
 from ruamel.yaml import YAML
 
-from .utils import get_request
+from .utils import get_request, get_session
 
 
 def get_github_auth():
@@ -170,7 +168,7 @@ def _get_login_code(client_id):
     header = {"Content-Type": "application/json", "Accept": "application/json"}
     payload = {"client_id": client_id}
     link = "https://github.com/login/device/code"
-    r = requests.post(link, headers=header, json=payload)
+    r = get_session().post(link, headers=header, json=payload)
 
     # process the response
     data = r.json()
@@ -217,7 +215,7 @@ def _poll_for_status(client_id, device_code):
         "device_code": device_code,
         "grant_type": "urn:ietf:params:oauth:grant-type:device_code",
     }
-    r = requests.post(
+    r = get_session().post(
         "https://github.com/login/oauth/access_token",
         headers=header,
         json=payload,
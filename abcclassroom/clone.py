@@ -5,19 +5,39 @@ abc-classroom.clone
 """
 
 import csv
-from pathlib import Path
-import shutil
+from pathlib import Path, PurePosixPath
 
+from . import auth
 from . import config as cf
 from . import git as abcgit
+from . import github as abcgithub
+from . import utils
 
 
-def clone_or_update_repo(organization, repo, clone_dir, skip_existing):
+# Directory inside clone_dir/assignment where abc-clone and abc-feedback keep
+# track of what they did on earlier runs
+STATE_DIR = ".abc-classroom"
+
+
+def clone_or_update_repo(
+    organization,
+    repo,
+    clone_dir,
+    skip_existing,
+    remote_heads=None,
+    strategy="full",
+    sparse_patterns=None,
+    reference=None,
+):
     """
     Tries to clone the single repository 'repo' from the organization. If the
     local repository already exists, pulls instead of cloning (unless the
     skip flag is set, in which case it does nothing).
 
+    If remote_heads is provided, checks the commit at the head of the
+    remote main branch first and does not pull if it matches the commit
+    recorded for the repo on an earlier run.
+
     Parameters
     ----------
     organization : string
@@ -28,6 +48,22 @@ def clone_or_update_repo(organization, repo, clone_dir, skip_existing):
         Name of the clone directory.
     skip_existing : boolean
         True if you wish to skip copying files to existing repos.
+    remote_heads : dict (optional)
+        Maps repository names to the remote commit last pulled or cloned.
+        Updated in place with the new commit for this repo.
+    strategy : string (default = "full")
+        How to clone new repositories; see git.clone_repo.
+    sparse_patterns : list of strings
+        Files to check out when strategy is "sparse"; see git.clone_repo.
+    reference : path (default = None)
+        Local repository to borrow objects from when cloning; see
+        git.clone_repo.
+
+    Returns
+    -------
+    string
+        What happened to the repository: one of "cloned", "updated",
+        "unchanged", "skipped" or "failed".
     """
     destination_dir = Path(clone_dir, repo)
     if destination_dir.is_dir():
@@ -38,18 +74,47 @@ def clone_or_update_repo(organization, repo, clone_dir, skip_existing):
                     destination_dir
                 )
             )
-            return
+            return "skipped"
+        head = None
+        if remote_heads is not None:
+            try:
+                head = abcgit.remote_head(organization, repo)
+            except RuntimeError:
+                # let the pull below report the problem
+                pass
+            if head is not None and remote_heads.get(repo) == head:
+                print("No new commits for {}; skipping pull".format(repo))
+                return "unchanged"
         try:
             abcgit.pull_from_github(destination_dir)
         except RuntimeError as e:
             print("Error pulling repository {}".format(destination_dir))
             print(e)
+            return "failed"
+        if remote_heads is not None and head is not None:
+            remote_heads[repo] = head
+        return "updated"
     else:
         try:
-            abcgit.clone_repo(organization, repo, clone_dir)
+            abcgit.clone_repo(
+                organization,
+                repo,
+                clone_dir,
+                strategy,
+                sparse_patterns,
+                reference,
+            )
         except RuntimeError as e:
             print("Error cloning repository {}".format(repo))
             print(e)
+            return "failed"
+        if remote_heads is not None:
+            try:
+                remote_heads[repo] = abcgit.head_commit(destination_dir)
+            except RuntimeError:
+                # empty repository, nothing to record
+                pass
+        return "cloned"
 
 
 def clone_student_repos(args):
@@ -58,19 +123,42 @@ def clone_student_repos(args):
     Parameters
     ----------
     args : string argument inputs
-        Arguments include the assignment name (string) and skip existing (
-        boolean?)
+        Arguments include the assignment name (string), skip existing (
+        boolean?) and the number of parallel jobs (int)
 
     """
 
     assignment_name = args.assignment
     skip_existing = args.skip_existing
     no_submitted = args.no_submitted
+    jobs = args.jobs
+    strategy = args.strategy
+    reference = args.reference
+    from_git = args.from_git
+    skip_missing = args.skip_missing
 
-    clone_repos(assignment_name, skip_existing, no_submitted)
+    clone_repos(
+        assignment_name,
+        skip_existing,
+        no_submitted,
+        jobs,
+        strategy,
+        reference,
+        from_git,
+        skip_missing,
+    )
 
 
-def clone_repos(assignment_name, skip_existing=False, no_submitted=True):
+def clone_repos(
+    assignment_name,
+    skip_existing=False,
+    no_submitted=True,
+    jobs=1,
+    strategy=None,
+    reference=None,
+    from_git=False,
+    skip_missing=None,
+):
     """Iterates through the student roster, clones each repo for this
     assignment into the directory specified in the config, and then copies the
     notebook files into the 'course_materials/submitted' directory, based on
@@ -87,6 +175,34 @@ def clone_repos(assignment_name, skip_existing=False, no_submitted=True):
         directory for grading. If false files are not moved to submitted
         dir. This might be useful if you want to update the student clone
         but don't want to update the file that was parsed by the autograder
+    jobs : int (default = 1)
+        Number of repositories to clone or pull at the same time. Files are
+        always copied to the submitted directory one student at a time, in
+        roster order, once all of the git operations are done.
+    strategy : string (default = None)
+        How to clone new repositories: full, shallow, blobless or sparse (see
+        git.clone_repo). If None, uses clone_strategy from config.yml, or
+        full if that is not set. The sparse strategy only checks out files
+        that match files_to_grade.
+    reference : string (default = None)
+        Where new clones borrow git objects they have in common with the
+        assignment template from: "template" = the local template repository
+        in template_dir; "cache" = a bare mirror of the template repository
+        on GitHub, kept in the clone directory; "none" = download and store
+        everything in each clone. If None, uses clone_reference from
+        config.yml, or "none" if that is not set.
+    from_git : boolean (default = False)
+        Copy files to the submitted directory from the latest commit in each
+        repository (read from the git objects) rather than from the working
+        tree.
+    skip_missing : boolean (default = None)
+        List the assignment repositories in the GitHub organization first,
+        and do not run git for students whose repository is not in the
+        list. The list comes from the abc-classroom-bot GitHub App, so
+        this needs the App to have access to all repositories in the
+        organization. If the list contains none of the students'
+        repositories, every repository is cloned anyway. If None, uses
+        skip_missing_repos from config.yml, or False if that is not set.
 
     Returns
     --------
@@ -95,17 +211,26 @@ def clone_repos(assignment_name, skip_existing=False, no_submitted=True):
     """
 
     print("Loading configuration from config.yml")
+    required = ("roster", "clone_dir", "organization")
+    if reference == "template":
+        required += ("template_dir",)
     try:
-        config = cf.get_config()
-    except (FileNotFoundError, RuntimeError) as err:
+        config = cf.CourseConfig.load(required=required)
+    except (FileNotFoundError, RuntimeError, KeyError, ValueError) as err:
         print(err)
         return
 
-    roster_filename = cf.get_config_option(config, "roster", True)
-    course_dir = cf.get_config_option(config, "course_directory", True)
-    clone_dir = cf.get_config_option(config, "clone_dir", True)
-    organization = cf.get_config_option(config, "organization", True)
-    materials_dir = cf.get_config_option(config, "course_materials", False)
+    roster_filename = config.roster
+    organization = config.organization
+    materials_dir = config.materials_dir
+    if strategy is None:
+        strategy = config.clone_strategy
+    sparse_patterns = _grade_patterns(config.files_to_grade)
+    if reference is None:
+        reference = config.clone_reference
+    if skip_missing is None:
+        skip_missing = config.skip_missing_repos
+    assignment_dir = config.clone_path(assignment_name)
 
     if materials_dir is None:
         print(
@@ -117,49 +242,104 @@ def clone_repos(assignment_name, skip_existing=False, no_submitted=True):
 
     try:
         # Create the assignment subdirectory path and ensure it exists
-        Path(course_dir, clone_dir, assignment_name).mkdir(exist_ok=True)
+        assignment_dir.mkdir(exist_ok=True)
         missing_repos = []
         missing_student_gh = []
+        students = []
 
         with open(roster_filename, newline="") as csvfile:
             reader = csv.DictReader(csvfile)
             try:
                 for row in reader:
+                    # Expected columns: identifier,github_username,
+                    # github_id,name
                     student = row["github_username"]
-                    print(student)
                     # If there is no student gh name skip trying to clone
                     if not student:
                         missing_student_gh.append(row)
                     else:
-                        # Expected columns: identifier,github_username,
-                        # github_id,name
-                        repo = "{}-{}".format(assignment_name, student)
-                        try:
-                            clone_or_update_repo(
-                                organization,
-                                repo,
-                                Path(clone_dir, assignment_name),
-                                skip_existing,
-                            )
-                            if materials_dir is not None and no_submitted:
-                                copy_assignment_files(
-                                    config, student, assignment_name
-                                )
-                                print(
-                                    "Copying files to the:",
-                                    materials_dir,
-                                    "dir",
-                                )
-                            else:
-                                print("Not copying files to submitted")
-                        except RuntimeError:
-                            missing_repos.append(repo)
+                        students.append(student)
             except KeyError as ke:
                 raise KeyError(
                     "Oops! Please check your roster file to "
                     "ensure is has the correct "
                     "headers. {}".format(ke)
                 )
+
+        # Commit at the head of each remote repo when we last pulled it, so
+        # that we can skip repos where the student has not pushed anything
+        heads_path = Path(assignment_dir, STATE_DIR, "remote_heads.json")
+        remote_heads = utils.read_json_file(heads_path)
+
+        def _clone_student(student):
+            repo = "{}-{}".format(assignment_name, student)
+            return clone_or_update_repo(
+                organization,
+                repo,
+                assignment_dir,
+                skip_existing,
+                remote_heads,
+                strategy,
+                sparse_patterns,
+                reference_path,
+            )
+
+        # Don't run git at all for students who have no repository
+        to_clone = students
+        remote_repos = None
+        if skip_missing:
+            remote_repos = _remote_repos(organization, assignment_name)
+        if remote_repos is not None:
+            to_clone = [
+                s
+                for s in students
+                if "{}-{}".format(assignment_name, s).lower() in remote_repos
+            ]
+            if students and not to_clone:
+                # more likely that the GitHub App can not see the
+                # repositories than that nobody accepted the assignment
+                print(
+                    "None of the repositories for {} are listed on GitHub; "
+                    "trying to clone all of them".format(assignment_name)
+                )
+                to_clone = students
+            elif len(to_clone) < len(students):
+                print(
+                    "{} students have no repository for {} on GitHub; not "
+                    "cloning them".format(
+                        len(students) - len(to_clone), assignment_name
+                    )
+                )
+
+        try:
+            with abcgit.ssh_connection_sharing(config.ssh_multiplexing):
+                reference_path = _reference_repo(
+                    config, organization, assignment_name, reference
+                )
+                cloned = utils.map_in_pool(_clone_student, to_clone, jobs)
+        finally:
+            utils.write_json_file(heads_path, remote_heads)
+        results = dict(zip(to_clone, cloned))
+
+        for student in students:
+            repo = "{}-{}".format(assignment_name, student)
+            result = results.get(student, "missing")
+            if result in ("failed", "missing"):
+                missing_repos.append(repo)
+                if not config.repo_path(assignment_name, student).is_dir():
+                    continue
+            if materials_dir is not None and no_submitted:
+                copy_assignment_files(
+                    config, student, assignment_name, from_git
+                )
+                print(
+                    "Copying files to the:",
+                    materials_dir,
+                    "dir",
+                )
+            else:
+                print("Not copying files to submitted")
+
         if len(missing_repos) == 0 and len(missing_student_gh) == 0:
             print("Great! All repos were successfully cloned!")
         else:
@@ -181,54 +361,180 @@ def clone_repos(assignment_name, skip_existing=False, no_submitted=True):
                     print(" {}".format(astudent))
 
     except FileNotFoundError as err:
-        abs_roster_path = Path(roster_filename).resolve()
         raise FileNotFoundError(
-            "Cannot find roster file: {}".format(abs_roster_path)
+            "Cannot find roster file: {}".format(roster_filename)
         )
         print(err)
 
 
-def copy_assignment_files(config, student, assignment_name):
+def _remote_repos(organization, assignment_name):
+    """Gets the names (in lower case) of all of the repositories for the
+    assignment in the GitHub organization with one sweep of the GitHub API.
+    Returns None if there is no GitHub token (see abc-init) or the API
+    request fails, in which case we try to clone every student's repository.
+    """
+    token = auth.get_github_auth().get("access_token")
+    if not token:
+        return None
+    try:
+        return abcgithub.list_assignment_repos(
+            organization, assignment_name, token
+        )
+    except Exception as e:
+        print(
+            "Could not list the repositories in {} on GitHub ({}); will try "
+            "to clone the repository of every student".format(organization, e)
+        )
+        return None
+
+
+def _reference_repo(config, organization, assignment_name, reference):
+    """Gets the full path to the local repository that new student clones
+    should borrow template objects from (see clone_repos for the options),
+    creating or updating the mirror of the template repository first if
+    reference is "cache". Returns None if there is no usable repository.
+
+    config is a config.CourseConfig."""
+    if reference in (None, "none"):
+        return None
+    template_name = "{}-template".format(assignment_name)
+
+    if reference == "template":
+        if config.template_dir is None:
+            raise KeyError(
+                "Oops! The template clone reference needs the template_dir "
+                "option in the config file"
+            )
+        template_path = config.template_path(assignment_name)
+        if not Path(template_path, ".git").is_dir():
+            print(
+                "No local template repository at {}; cloning without "
+                "a reference repository".format(template_path)
+            )
+            return None
+        return template_path.resolve()
+
+    if reference == "cache":
+        mirror_path = Path(
+            config.clone_path(assignment_name), STATE_DIR, "template.git"
+        ).resolve()
+        try:
+            abcgit.update_mirror(organization, template_name, mirror_path)
+        except RuntimeError as e:
+            print(
+                "Could not update the template cache at {}; cloning without "
+                "a reference repository".format(mirror_path)
+            )
+            print(e)
+            return None
+        return mirror_path
+
+    raise ValueError(
+        "Unknown clone reference {}; must be one of {}".format(
+            reference, ", ".join(cf.CLONE_REFERENCES)
+        )
+    )
+
+
+def _grade_patterns(files_to_grade):
+    """Turns the files_to_grade list of file extensions from the config
+    (e.g. [".py", ".ipynb"]) into file patterns (e.g. ["*.py", "*.ipynb"]).
+    Uses notebooks only if files_to_grade is empty."""
+    if not files_to_grade:
+        files_to_grade = [".ipynb"]
+    return [
+        "*" + ext if ext.startswith(".") else ext for ext in files_to_grade
+    ]
+
+
+def copy_assignment_files(config, student, assignment_name, from_git=False):
     """Copies all notebook files from clone_dir to course_materials/submitted.
     Will overwrite any existing files with the same name.
 
+    Skips files that match files_to_ignore (e.g. notebooks in
+    .ipynb_checkpoints directories).
+
+    Only copies files that are new or have changed since the last run, so
+    that unchanged files in submitted keep their modification times. Keeps
+    the size, modification time and hash of each copied file in
+    clone_dir/assignment/.abc-classroom/submitted/student.json.
+
     Parameters
     -----------
-    config: dict
-        config file returned as a dictionary from get_config()
+    config: config.CourseConfig or dict
+        The course configuration; a config dict returned by get_config() is
+        turned into a CourseConfig first.
     student: string
         Name of the student whose files are being copied
     assignment_name: string
         Name of the assignment for which files are being copied
+    from_git: boolean (default = False)
+        If true, copies the files as of the latest commit in the student
+        repository, reading them from the git objects rather than from
+        the working tree. Faster for large repositories with many files.
 
     """
-    course_dir = cf.get_config_option(config, "course_directory", True)
-    materials_dir = cf.get_config_option(config, "course_materials", False)
-    clone_dir = cf.get_config_option(config, "clone_dir", True)
-    files_to_grade = cf.get_config_option(config, "files_to_grade", False)
-    repo = "{}-{}".format(assignment_name, student)
+    config = cf.course_config(
+        config, required=("clone_dir", "course_materials")
+    )
+    files_to_grade = config.files_to_grade
+    copy_method = config.copy_method
+    ignore = config.ignore
 
     # Copy files from the cloned_dirs to submitted directory
-    source_dir = Path(course_dir, clone_dir, assignment_name, repo)
-    destination = Path(
-        course_dir, materials_dir, "submitted", student, assignment_name
+    source_dir = config.repo_path(assignment_name, student)
+    destination = config.submitted_path(student, assignment_name)
+    manifest_path = Path(
+        config.clone_path(assignment_name),
+        STATE_DIR,
+        "submitted",
+        "{}.json".format(student),
     )
 
     destination.mkdir(parents=True, exist_ok=True)
     print("Copying files from {} to {}".format(Path(source_dir), destination))
+    old_manifest = utils.read_json_file(manifest_path)
+    manifest = {}
+    copied = 0
+
+    if from_git:
+        try:
+            copied = _copy_files_from_git(
+                source_dir,
+                destination,
+                files_to_grade,
+                old_manifest,
+                manifest,
+                ignore,
+            )
+        except RuntimeError as e:
+            print("Could not read files from git in {}".format(source_dir))
+            print(e)
+            return
+    else:
+        # Only move files with extensions needed for grading
+        # NOTE: if there is a notebook or script in a subdirectory shutil
+        # does not handle the subdirectory - it spits the file back into the
+        # main dir.
+        for a_file in source_dir.glob(r"**/*"):
+            if a_file.suffix not in files_to_grade or not a_file.is_file():
+                continue
+            rel_path = a_file.relative_to(source_dir).as_posix()
+            if ignore.ignored(rel_path):
+                continue
+            dest_file = Path(destination, a_file.name)
+            manifest[rel_path], changed = _sync_file(
+                a_file, dest_file, old_manifest.get(rel_path), copy_method
+            )
+            if changed:
+                copied += 1
 
-    # Only move files with extensions needed for grading
-    # NOTE: if there is a notebook or script in a subdirectory shutil does not
-    # handle the subdirectory - it spits the file back into the main dir.
-    for a_file in Path(course_dir, clone_dir, assignment_name, repo).glob(
-        r"**/*"
-    ):
-        # If files to grade is not populated then just move notebooks
-        if not files_to_grade:
-            files_to_grade = [".ipynb"]
-        if a_file.suffix in files_to_grade:
-            print("copying {} to {}".format(a_file, destination))
-            shutil.copy(a_file, destination)
+    utils.write_json_file(manifest_path, manifest)
+    print(
+        "Copied {} new or changed files ({} unchanged)".format(
+            copied, len(manifest) - copied
+        )
+    )
 
     # In this case, IF you have a graded html file that will get moved over
     # Using the copytree function from util to make copying easier
@@ -239,3 +545,87 @@ def copy_assignment_files(config, student, assignment_name):
     #     ignore=shutil.ignore_patterns(*ignore_files),
     #     dirs_exist_ok=True,
     # )
+
+
+def _sync_file(src, dest, entry, method="auto"):
+    """Copies src to dest (with utils.copy_file, using method) unless the
+    manifest entry recorded when it was last copied shows that neither file
+    has changed since. A source file that was touched but has the same
+    contents is not copied again.
+
+    Returns the new manifest entry and whether the file was copied.
+    """
+    src_stat = src.stat()
+    try:
+        dest_stat = dest.stat()
+    except FileNotFoundError:
+        dest_stat = None
+
+    if entry is not None and dest_stat is not None:
+        dest_unchanged = dest_stat.st_size == entry.get(
+            "size"
+        ) and dest_stat.st_mtime_ns == entry.get("dest_mtime_ns")
+        src_same_stat = src_stat.st_size == entry.get(
+            "size"
+        ) and src_stat.st_mtime_ns == entry.get("mtime_ns")
+        if dest_unchanged and src_same_stat:
+            return entry, False
+        if dest_unchanged and abcgit.blob_hash(src) == entry.get("hash"):
+            # same contents, just record the new stats
+            return dict(entry, mtime_ns=src_stat.st_mtime_ns), False
+
+    utils.copy_file(src, dest, method)
+    entry = {
+        "size": src_stat.st_size,
+        "mtime_ns": src_stat.st_mtime_ns,
+        "dest_mtime_ns": dest.stat().st_mtime_ns,
+        "hash": abcgit.blob_hash(src),
+    }
+    return entry, True
+
+
+def _copy_files_from_git(
+    source_dir, destination, files_to_grade, old_manifest, manifest, ignore
+):
+    """Copies the files to grade from the latest commit of the repository in
+    source_dir into destination, using git ls-tree to find them and a single
+    git cat-file process to write them. Files whose git object id matches
+    the manifest entry from the last run (and whose copy in destination has
+    not changed) are skipped, as are files that match ignore (a
+    utils.IgnoreMatcher). Fills in manifest and returns the number of files
+    copied."""
+    to_write = []
+    for rel_path, object_id in abcgit.list_files(source_dir):
+        if PurePosixPath(rel_path).suffix not in files_to_grade:
+            continue
+        if ignore.ignored(rel_path):
+            continue
+        dest_file = Path(destination, PurePosixPath(rel_path).name)
+        entry = old_manifest.get(rel_path)
+        if entry is not None and entry.get("hash") == object_id:
+            try:
+                dest_stat = dest_file.stat()
+            except FileNotFoundError:
+                dest_stat = None
+            if (
+                dest_stat is not None
+                and dest_stat.st_size == entry.get("size")
+                and dest_stat.st_mtime_ns == entry.get("dest_mtime_ns")
+            ):
+                manifest[rel_path] = entry
+                continue
+        to_write.append((rel_path, object_id, dest_file))
+
+    abcgit.write_blobs(
+        source_dir, [(object_id, dest) for _, object_id, dest in to_write]
+    )
+    for rel_path, object_id, dest_file in to_write:
+        dest_stat = dest_file.stat()
+        manifest[rel_path] = {
+            "size": dest_stat.st_size,
+            # no working tree file to compare with next time
+            "mtime_ns": None,
+            "dest_mtime_ns": dest_stat.st_mtime_ns,
+            "hash": object_id,
+        }
+    return len(to_write)
@@ -4,11 +4,39 @@ abc-classroom.config
 
 """
 
+import copy
+import os
 import pprint
+import threading
 from pathlib import Path
 from ruamel.yaml import YAML
 import ruamel.yaml.composer
 
+from . import git as abcgit
+from . import utils
+
+# Parsed config files, by absolute path. Each entry is
+# ((mtime_ns, size, inode), config) for the file as it was when parsed.
+_config_cache = {}
+_config_cache_lock = threading.Lock()
+
+
+def _config_file(configpath):
+    if configpath is None:
+        return Path("config.yml")
+    return Path(configpath, "config.yml")
+
+
+def _cache_key(configfile):
+    return os.path.abspath(configfile)
+
+
+def clear_config_cache():
+    """Forgets every config file parsed by get_config, so that the next call
+    reads the file again."""
+    with _config_cache_lock:
+        _config_cache.clear()
+
 
 def get_config(configpath=None):
     """Attempts to read a config file at the provided path (or at
@@ -16,20 +44,32 @@ def get_config(configpath=None):
     config file found, and RuntimeError if there
     is a problem reading the file.
 
+    The parsed file is cached for the rest of the process, so later calls
+    only parse it again if its modification time or size has changed (or
+    write_config has written it). Each call returns its own copy, which
+    can be modified without affecting the cache.
+
     Returns
     -------
     ruamel.yaml.comments.CommentedMap
         Yaml object that contains the contents of the config file.
     """
-    yaml = YAML()
+    configpath = _config_file(configpath)
+    key = _cache_key(configpath)
     try:
-        if configpath is None:
-            configpath = Path("config.yml")
-        else:
-            configpath = Path(configpath, "config.yml")
+        info = os.stat(configpath)
+        version = (info.st_mtime_ns, info.st_size, info.st_ino)
+        with _config_cache_lock:
+            cached = _config_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return copy.deepcopy(cached[1])
+        # YAML instances are not thread safe, so use a new one for each file
+        yaml = YAML()
         with open(configpath) as f:
             config = yaml.load(f)
-        return config
+        with _config_cache_lock:
+            _config_cache[key] = (version, config)
+        return copy.deepcopy(config)
     except ruamel.yaml.composer.ComposerError:
         raise RuntimeError(
             "Error reading config.yml. This can happen if the config "
@@ -67,10 +107,9 @@ def print_config(config=None, configpath=None):
 
 def write_config(config, configpath=None):
     yaml = YAML()
-    if configpath is None:
-        configpath = Path("config.yml")
-    else:
-        configpath = Path(configpath, "config.yml")
+    configpath = _config_file(configpath)
+    with _config_cache_lock:
+        _config_cache.pop(_cache_key(configpath), None)
     with open(configpath, "w") as f:
         yaml.dump(config, f)
 
@@ -121,3 +160,199 @@ def set_config_option(
     print("Writing modified config at {}".format(configpath))
     write_config(config, configpath)
     return config
+
+
+# Values allowed for clone_reference in config.yml (see clone.clone_repos)
+CLONE_REFERENCES = ("none", "template", "cache")
+
+
+class CourseConfig:
+    """The course configuration, checked and resolved once at the start of a
+    command and then passed down to the functions that do the work.
+
+    All paths are absolute: relative paths in the config are taken to be
+    relative to course_directory. The directories that the commands use
+    (release, submitted and feedback in course_materials, the clone and
+    template directories) are worked out once here.
+
+    Parameters
+    ----------
+    config : dict
+        The config file contents, as returned by get_config().
+    required : list of strings (default = ())
+        Options (besides course_directory, which is always required) that
+        the command needs. A KeyError is raised if any of them is missing.
+
+    Raises
+    ------
+    KeyError
+        If a required option is missing.
+    ValueError
+        If an option has a value that abc-classroom does not understand.
+    """
+
+    __slots__ = (
+        "config",
+        "course_dir",
+        "materials_dir",
+        "clone_dir",
+        "template_dir",
+        "extra_files_dir",
+        "release_dir",
+        "submitted_dir",
+        "feedback_dir",
+        "roster",
+        "organization",
+        "files_to_grade",
+        "files_to_ignore",
+        "ignore",
+        "copy_method",
+        "git_backend",
+        "clone_strategy",
+        "clone_reference",
+        "ssh_multiplexing",
+        "skip_missing_repos",
+    )
+
+    def __init__(self, config, required=()):
+        for option in required:
+            get_config_option(config, option, True)
+        self.config = config
+
+        self.course_dir = Path(
+            os.path.abspath(get_config_option(config, "course_directory"))
+        )
+        self.extra_files_dir = Path(self.course_dir, "extra_files")
+        self.materials_dir = self._path(config, "course_materials")
+        self.clone_dir = self._path(config, "clone_dir")
+        self.template_dir = self._path(config, "template_dir")
+        self.roster = self._path(config, "roster")
+        if self.materials_dir is None:
+            self.release_dir = self.submitted_dir = self.feedback_dir = None
+        else:
+            self.release_dir = Path(self.materials_dir, "release")
+            self.submitted_dir = Path(self.materials_dir, "submitted")
+            self.feedback_dir = Path(self.materials_dir, "feedback")
+
+        self.organization = get_config_option(config, "organization", False)
+        files_to_grade = _list_option(config, "files_to_grade")
+        # If files to grade is not populated then just use notebooks
+        self.files_to_grade = files_to_grade or [".ipynb"]
+        self.files_to_ignore = _list_option(config, "files_to_ignore")
+        self.ignore = utils.get_ignore_matcher(self.files_to_ignore)
+
+        self.copy_method = _choice_option(
+            config, "copy_method", utils.COPY_METHODS, "auto"
+        )
+        self.git_backend = _choice_option(
+            config, "git_backend", tuple(abcgit.GIT_BACKENDS), None
+        )
+        self.clone_strategy = _choice_option(
+            config, "clone_strategy", abcgit.CLONE_STRATEGIES, "full"
+        )
+        self.clone_reference = _choice_option(
+            config, "clone_reference", CLONE_REFERENCES, "none"
+        )
+        if self.clone_reference == "template":
+            # the local template repositories are in template_dir
+            get_config_option(config, "template_dir", True)
+        self.ssh_multiplexing = _bool_option(config, "ssh_multiplexing", True)
+        self.skip_missing_repos = _bool_option(
+            config, "skip_missing_repos", False
+        )
+
+    @classmethod
+    def load(cls, configpath=None, required=()):
+        """Reads config.yml (see get_config) and returns it as a
+        CourseConfig (see the class for the parameters and exceptions)."""
+        return cls(get_config(configpath), required)
+
+    def _path(self, config, option):
+        value = get_config_option(config, option, False)
+        if value is None:
+            return None
+        return Path(utils.get_abspath(value, self.course_dir))
+
+    def release_path(self, assignment):
+        """course_materials/release/assignment"""
+        return Path(self.release_dir, assignment)
+
+    def submitted_path(self, student, assignment):
+        """course_materials/submitted/student/assignment"""
+        return Path(self.submitted_dir, student, assignment)
+
+    def feedback_path(self, student, assignment):
+        """course_materials/feedback/student/assignment"""
+        return Path(self.feedback_dir, student, assignment)
+
+    def clone_path(self, assignment):
+        """The directory in clone_dir that holds the student repositories
+        for the assignment."""
+        return Path(self.clone_dir, assignment)
+
+    def repo_path(self, assignment, student):
+        """The local clone of the student's repository for the
+        assignment."""
+        return Path(
+            self.clone_dir, assignment, "{}-{}".format(assignment, student)
+        )
+
+    def template_path(self, assignment):
+        """The local template repository for the assignment."""
+        return Path(self.template_dir, "{}-template".format(assignment))
+
+
+def course_config(config, required=()):
+    """Returns config as a CourseConfig. config can be a CourseConfig (which
+    is returned as is) or a config dict from get_config()."""
+    if isinstance(config, CourseConfig):
+        return config
+    return CourseConfig(config, required)
+
+
+def _list_option(config, option):
+    """Gets an option that holds a list of strings. A single string is
+    treated as a list with one item and a missing option as an empty
+    list."""
+    value = get_config_option(config, option, False)
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or not all(
+        isinstance(v, str) for v in value
+    ):
+        raise ValueError(
+            "Oops! {} in the config file must be a list of file names or "
+            "patterns, not {}".format(option, value)
+        )
+    return list(value)
+
+
+def _choice_option(config, option, choices, default):
+    """Gets an option that must be one of choices, or default if it is not
+    set."""
+    value = get_config_option(config, option, False)
+    if value is None:
+        return default
+    if value not in choices:
+        raise ValueError(
+            "Oops! {} in the config file must be one of {}, not {}".format(
+                option, ", ".join(choices), value
+            )
+        )
+    return value
+
+
+def _bool_option(config, option, default):
+    """Gets an option that must be true or false, or default if it is not
+    set."""
+    value = get_config_option(config, option, False)
+    if value is None:
+        return default
+    if value not in (True, False):
+        raise ValueError(
+            "Oops! {} in the config file must be true or false, not "
+            "{}".format(option, value)
+        )
+    return bool(value)
@@ -3,24 +3,42 @@ abc-classroom.feedback
 ======================
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import csv
+import functools
+import hashlib
 import shutil
+import threading
 
 from . import config as cf
 from . import git as abcgit
+from . import utils
+from .clone import STATE_DIR
 
 # or import just the function we need?
 from . import scrub_feedback as sf
 
 
-def copy_feedback_files(assignment_name, push_to_github=False, scrub=False):
+def copy_feedback_files(
+    assignment_name, push_to_github=False, scrub=False, jobs=1
+):
     """Copies feedback reports to local student repositories, commits the
     changes,
     and (optionally) pushes to github. Assumes files are in the directory
     course_materials/feedback/student/assignment. Copies all html files in
     the source directory.
 
+    Students are processed in roster order. Pushes to GitHub run in the
+    background (up to ``jobs`` at a time) while the next students' files are
+    copied and committed. Prints a summary for every student at the end.
+
+    Keeps a ledger of the feedback released to each student in
+    clone_dir/assignment/.abc-classroom/feedback.json. Students whose
+    feedback files have not changed since they were committed (and pushed,
+    if pushing) are skipped without running git, and pushes that did not
+    finish in an earlier run are retried.
+
     Parameters
     -----------
     assignment_name: string
@@ -31,6 +49,8 @@ def copy_feedback_files(assignment_name, push_to_github=False, scrub=False):
     scrub: boolean
         If true, and we are moving an html file this will clean the html file
         before copying it over.
+    jobs: int (default = 1)
+        Maximum number of pushes to GitHub to run at the same time.
 
     Returns
     -------
@@ -41,87 +61,196 @@ def copy_feedback_files(assignment_name, push_to_github=False, scrub=False):
 
     print("Loading configuration from config.yml")
     try:
-        config = cf.get_config()
-    except (FileNotFoundError, RuntimeError) as err:
+        config = cf.CourseConfig.load(
+            required=("roster", "clone_dir", "course_materials")
+        )
+    except (FileNotFoundError, RuntimeError, KeyError, ValueError) as err:
         print(err)
         return
 
-    # Get various paths from config
-    # I think we do this a bunch so is it worth a helper for it?
-    roster_filename = cf.get_config_option(config, "roster", True)
-    course_dir = cf.get_config_option(config, "course_directory", True)
-    clone_dir = cf.get_config_option(config, "clone_dir", True)
-    materials_dir = cf.get_config_option(config, "course_materials", True)
+    roster_filename = config.roster
+
+    # Record of the feedback already released to each student, so that
+    # re-running only does the work that is left. See _release_feedback.
+    ledger_path = Path(
+        config.clone_path(assignment_name), STATE_DIR, "feedback.json"
+    )
+    ledger = utils.read_json_file(ledger_path)
+    ledger_lock = threading.Lock()
 
+    def _record_push(student, push):
+        if push.exception() is None:
+            with ledger_lock:
+                ledger[student]["pushed"] = True
+                utils.write_json_file(ledger_path, ledger)
+
+    # What happened for each student, in roster order
+    report = {}
     try:
-        feedback_dir = Path(course_dir, materials_dir, "feedback")
-        with open(roster_filename, newline="") as csvfile:
+        share_ssh = push_to_github and config.ssh_multiplexing
+        backend = abcgit.use_git_backend(config.git_backend)
+        sharing = abcgit.ssh_connection_sharing(share_ssh)
+        with backend, sharing, open(
+            roster_filename, newline=""
+        ) as csvfile, ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+            pushes = {}
             reader = csv.DictReader(csvfile)
             for row in reader:
                 student = row["github_username"]
-                feedback_path = Path(feedback_dir, student, assignment_name)
-                source_files = list(feedback_path.glob("*.html"))
-                repo_name = "{}-{}".format(assignment_name, student)
+                feedback_path = config.feedback_path(student, assignment_name)
                 # The repos now live in clone_dir/assignment-name/repo-name
-                destination_dir = Path(clone_dir, assignment_name, repo_name)
+                destination_dir = config.repo_path(assignment_name, student)
                 if not destination_dir.is_dir():
-                    print(
-                        "Local student repository {} does not exist; skipping "
-                        "student".format(destination_dir)
+                    report[student] = (
+                        False,
+                        "local repository {} does not exist".format(
+                            destination_dir
+                        ),
                     )
                     continue
-                # TODO: Turn this into a helper function lines 46 - 64 here
-                # Don't copy any system related files -- not this is exactly
-                # the same code used in the template.py copy files function.
-                # this could become a helper that just moves files. I think
-                # we'd call it a few times so it's worth doing... and when /
-                # if we add support to move directories we could just add it
-                # in one place.
-                files_to_ignore = cf.get_config_option(
-                    config, "files_to_ignore", True
-                )
-                # This won't work when the entire path is provided
-                # TODO: either parse files first and then create the site
-                #  and paths or figure out another approach with generator
-                # objects? maybe a list comprehension?
-                files_to_move = set(source_files).difference(files_to_ignore)
-
-                for f in files_to_move:
-                    if scrub:
-                        # If f has an html extension and scrub is true
-                        # Clean the file and overwrite existing html
-                        sf.scrub_feedback(f)
-                        print("Removing hidden tests before copying")
-                    print(
-                        "Copying {} to {}".format(
-                            f.relative_to(course_dir), destination_dir
-                        )
+                try:
+                    summary, entry = _release_feedback(
+                        feedback_path,
+                        destination_dir,
+                        assignment_name,
+                        config.ignore,
+                        scrub,
+                        ledger.get(student),
                     )
-                    shutil.copy(f, destination_dir)
-
-                abcgit.commit_all_changes(
-                    destination_dir,
-                    msg="Adding feedback for assignment {}".format(
-                        assignment_name
-                    ),
+                except (OSError, RuntimeError) as e:
+                    report[student] = (
+                        False,
+                        "copy or commit failed: {}".format(e),
+                    )
+                    continue
+                with ledger_lock:
+                    if ledger.get(student) is not entry:
+                        ledger[student] = entry
+                        utils.write_json_file(ledger_path, ledger)
+                report[student] = (True, summary)
+                if entry["pushed"] or not push_to_github:
+                    continue
+                pushes[student] = pool.submit(
+                    abcgit.push_to_github, destination_dir
+                )
+                pushes[student].add_done_callback(
+                    functools.partial(_record_push, student)
                 )
-                if push_to_github:
-                    try:
-                        abcgit.push_to_github(destination_dir)
-                    except RuntimeError as e:
-                        print(e)
-                        print(
-                            "Push to GitHub failed for repo {}".format(
-                                destination_dir
-                            )
-                        )
+
+            for student, push in pushes.items():
+                try:
+                    push.result()
+                except Exception as e:
+                    # e.g. FileNotFoundError if git is not installed; report
+                    # it for this student rather than stopping everything
+                    report[student] = (
+                        False,
+                        "{}; push to GitHub failed: {}".format(
+                            report[student][1], str(e).strip()
+                        ),
+                    )
+                else:
+                    report[student] = (
+                        True,
+                        "{}; pushed".format(report[student][1]),
+                    )
 
     except FileNotFoundError as err:
-        abs_roster_path = Path(roster_filename).resolve()
         raise FileNotFoundError(
-            "Cannot find roster file: {}".format(abs_roster_path)
+            "Cannot find roster file: {}".format(roster_filename)
+        ) from err
+    finally:
+        _print_feedback_report(assignment_name, report)
+
+
+def _release_feedback(
+    feedback_path,
+    destination_dir,
+    assignment_name,
+    ignore,
+    scrub,
+    entry,
+):
+    """Copies (and optionally scrubs) the html feedback files for one student
+    into their local repository and commits them. Files that match ignore
+    (the utils.IgnoreMatcher for files_to_ignore) are left out.
+
+    entry is the student's record in the release ledger from earlier runs
+    (or None): a hash of the feedback files, the commit they were released
+    in and whether that commit was pushed. If the files have not changed
+    since and are still in the repository, nothing is copied and git is
+    not run.
+
+    Returns a short description of what was done, for the summary report,
+    and the (new or unchanged) ledger entry.
+    """
+    files_to_move = sorted(
+        f for f in feedback_path.glob("*.html") if not ignore.match(f.name)
+    )
+
+    hidden_tests = 0
+    for f in files_to_move:
+        if scrub:
+            # If f has an html extension and scrub is true
+            # Clean the file and overwrite existing html (does nothing if
+            # the file has already been scrubbed)
+            hidden_tests += sf.scrub_feedback(f)
+    files_hash = _hash_files(files_to_move)
+
+    if (
+        entry is not None
+        and entry.get("files") == files_hash
+        and all(Path(destination_dir, f.name).is_file() for f in files_to_move)
+    ):
+        if entry.get("pushed"):
+            return "feedback already released", entry
+        return "feedback already committed", entry
+
+    for f in files_to_move:
+        shutil.copy(f, destination_dir)
+
+    committed = abcgit.commit_all_changes(
+        destination_dir,
+        msg="Adding feedback for assignment {}".format(assignment_name),
+        # "no changes" goes in the summary report instead
+        quiet=True,
+    )
+    summary = "copied {} files".format(len(files_to_move))
+    if scrub:
+        summary += "; removed {} hidden test blocks".format(hidden_tests)
+    summary = "{}; {}".format(
+        summary, "committed" if committed else "no changes"
+    )
+    entry = {
+        "files": files_hash,
+        "commit": abcgit.head_commit(destination_dir),
+        "pushed": False,
+    }
+    return summary, entry
+
+
+def _hash_files(paths):
+    """Returns a single hash of the names and contents of a list of files."""
+    sha = hashlib.sha1()
+    for path in paths:
+        sha.update(
+            "{} {}\n".format(path.name, abcgit.blob_hash(path)).encode()
         )
-        print(err)
+    return sha.hexdigest()
+
+
+def _print_feedback_report(assignment_name, report):
+    """Prints the outcome of abc-feedback for each student."""
+    if not report:
+        return
+    failed = [student for student, (ok, _) in report.items() if not ok]
+    print(
+        "Feedback for {}: {} students succeeded, {} failed".format(
+            assignment_name, len(report) - len(failed), len(failed)
+        )
+    )
+    for student, (ok, message) in report.items():
+        print(" {} {}: {}".format("ok  " if ok else "FAIL", student, message))
 
 
 def copy_feedback(args):
@@ -142,6 +271,8 @@ def copy_feedback(args):
     scrub : boolean (default = False)
         If true (exists), remove hidden tests from the html output
         before moving it to the student directory
+    jobs : int (default = 1)
+        Maximum number of pushes to GitHub to run at the same time
 
     Returns
     -------
@@ -152,5 +283,6 @@ def copy_feedback(args):
     assignment_name = args.assignment
     push_to_github = args.github
     scrub = args.scrub
+    jobs = args.jobs
 
-    copy_feedback_files(assignment_name, push_to_github, scrub)
+    copy_feedback_files(assignment_name, push_to_github, scrub, jobs)
@@ -6,16 +6,71 @@ abc-classroom.git
 # Methods for command line git operations. See github.py for
 # methods that involve the GitHub API
 
+import atexit
+import collections
+import contextlib
+import hashlib
+import os
+import shlex
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
 
+# Result of the last successful ssh check (a time.monotonic() timestamp),
+# shared by every git operation in this process. See check_git_ssh.
+_ssh_check = {"checked_at": None}
+_ssh_check_lock = threading.Lock()
 
-def check_git_ssh():
+# Extra ssh options for connections to GitHub. Only set inside an
+# ssh_connection_sharing() block. See _git_env.
+_ssh_options = []
+# core.sshCommand from the git config, by directory. Only kept inside an
+# ssh_connection_sharing() block. See _configured_ssh_command.
+_ssh_commands = {}
+
+
+def check_git_ssh(force=False, ttl=None):
     """Tests that ssh access to GitHub is set up correctly on the users
     computer.
 
+    A successful check is remembered, so that running many git commands
+    (e.g. cloning every repository in the roster) only does one ssh
+    handshake with GitHub. Failed checks are not remembered.
+
     Throws a RuntimeError if setup is not working.
+
+    Parameters
+    ----------
+    force : boolean (default = False)
+        If True, re-run the check even if an earlier one succeeded.
+    ttl : number (default = None)
+        How long (in seconds) a successful check stays valid. If None, it
+        is valid for the life of the process.
     """
-    cmd = ["ssh", "-T", "git@github.com"]
+    with _ssh_check_lock:
+        checked_at = _ssh_check["checked_at"]
+        if not force and checked_at is not None:
+            if ttl is None or time.monotonic() - checked_at < ttl:
+                return
+        _ssh_check["checked_at"] = None
+        if _run_ssh_check():
+            _ssh_check["checked_at"] = time.monotonic()
+
+
+def reset_git_ssh_check():
+    """Forget the result of any earlier ssh check, so that the next call to
+    check_git_ssh contacts GitHub again."""
+    with _ssh_check_lock:
+        _ssh_check["checked_at"] = None
+
+
+def _run_ssh_check():
+    """Runs ``ssh -T git@github.com`` and checks the output. Returns True if
+    ssh access works, False if ssh is not installed, and throws a
+    RuntimeError for any other problem."""
+    cmd = ["ssh"] + _ssh_options + ["-T", "git@github.com"]
     try:
         subprocess.run(
             cmd,
@@ -41,7 +96,6 @@ def check_git_ssh():
             # If they do so, the message is 'Warning: Permanently
             # added 'github.com' (RSA) to the list of known hosts.'
             print(subprocess_out)
-            pass
         else:
             # possible reasons to get here include 1. no ssh key set up;
             # 2. ssh key has incorrect permissions; 3. remote host
@@ -66,6 +120,98 @@ def check_git_ssh():
                 """Did not find `ssh` command. Make sure that open-ssh
                 is installed on your operating system."""
             )
+        return False
+    return True
+
+
+@contextlib.contextmanager
+def ssh_connection_sharing(enabled=True):
+    """Context manager that makes all git commands run inside the with
+    block share a single ssh connection to GitHub (using the ssh
+    ControlMaster option), rather than each clone, pull or push doing its
+    own ssh handshake. The shared connection is closed when the block exits.
+
+    Does nothing on Windows, where OpenSSH does not support connection
+    sharing, or if another block is already active.
+
+    Parameters
+    ----------
+    enabled : boolean (default = True)
+        Set to False to run the block without connection sharing. Set from
+        the ssh_multiplexing option in config.yml.
+    """
+    if not enabled or os.name == "nt" or _ssh_options:
+        yield
+        return
+
+    # ssh limits the length of the socket path, so keep it short (the macOS
+    # default temporary directory is very long)
+    tmp_root = "/tmp" if os.path.isdir("/tmp") else None
+    control_dir = tempfile.mkdtemp(prefix="abc-ssh-", dir=tmp_root)
+    options = [
+        "-o",
+        "ControlMaster=auto",
+        "-o",
+        "ControlPath={}".format(os.path.join(control_dir, "%C")),
+        # in case we never get to close the connection ourselves
+        "-o",
+        "ControlPersist=60",
+    ]
+    _ssh_options.extend(options)
+    try:
+        yield
+    finally:
+        _ssh_options.clear()
+        _ssh_commands.clear()
+        try:
+            subprocess.run(
+                ["ssh"] + options + ["-O", "exit", "git@github.com"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(control_dir, ignore_errors=True)
+
+
+def _configured_ssh_command(directory=None):
+    """Returns core.sshCommand from the git config that applies in
+    directory, or None if it is not set."""
+    key = None if directory is None else os.path.abspath(directory)
+    if key not in _ssh_commands:
+        try:
+            ret = subprocess.run(
+                ["git", "config", "--get", "core.sshCommand"],
+                cwd=directory,
+                universal_newlines=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            command = ret.stdout.strip() if ret.returncode == 0 else None
+        except OSError:
+            command = None
+        _ssh_commands[key] = command or None
+    return _ssh_commands[key]
+
+
+def _git_env(directory=None):
+    """Returns the environment for git subprocesses run in directory, or
+    None to use the current environment. Inside an ssh_connection_sharing()
+    block, sets GIT_SSH_COMMAND so that git uses the shared ssh connection,
+    keeping any ssh command the user has already set (in GIT_SSH_COMMAND
+    or, since GIT_SSH_COMMAND overrides it, core.sshCommand)."""
+    if not _ssh_options:
+        return None
+    if "GIT_SSH" in os.environ and "GIT_SSH_COMMAND" not in os.environ:
+        # GIT_SSH_COMMAND would override the user's GIT_SSH program
+        return None
+    ssh_command = os.environ.get("GIT_SSH_COMMAND")
+    if ssh_command is None:
+        ssh_command = _configured_ssh_command(directory) or "ssh"
+    options = " ".join(shlex.quote(o) for o in _ssh_options)
+    env = dict(os.environ)
+    env["GIT_SSH_COMMAND"] = "{} {}".format(ssh_command, options)
+    return env
 
 
 def _call_git(*args, directory=None):
@@ -75,6 +221,7 @@ def _call_git(*args, directory=None):
         ret = subprocess.run(
             cmd,
             cwd=directory,
+            env=_git_env(directory),
             check=True,
             universal_newlines=True,
             stdout=subprocess.PIPE,
@@ -89,7 +236,18 @@ def _call_git(*args, directory=None):
     return ret
 
 
-def clone_repo(organization, repo, dest_dir):
+# Ways of cloning student repositories. See clone_repo.
+CLONE_STRATEGIES = ("full", "shallow", "blobless", "sparse")
+
+
+def clone_repo(
+    organization,
+    repo,
+    dest_dir,
+    strategy="full",
+    sparse_patterns=None,
+    reference=None,
+):
     """Clone `repository` from `org` into a sub-directory in `directory`.
 
     Raises RuntimeError if ssh keys not set up correctly, or if git clone
@@ -105,43 +263,361 @@ def clone_repo(organization, repo, dest_dir):
         Path to the destination directory
         TODO: is this a full path, path object or string - what format is
         dest_dir in
+    strategy : string (default = "full")
+        How much of the repository to download. One of:
+        full = the complete history;
+        shallow = only the latest commit (``--depth 1``);
+        blobless = all commits, but file contents are only downloaded when
+        they are checked out (``--filter=blob:none``);
+        sparse = blobless, and only check out files that match
+        sparse_patterns.
+    sparse_patterns : list of strings
+        Patterns (in .gitignore format) of the files to check out when
+        strategy is sparse, e.g. ["*.ipynb"].
+    reference : path (default = None)
+        Full path to a local repository that shares history with the one
+        being cloned (e.g. the assignment template). Objects that already
+        exist there are borrowed rather than downloaded and stored again
+        (``--reference-if-able``). The clone keeps depending on the
+        reference repository, so it must not be deleted.
+
     Returns
     -------
     Cloned github repository in the destination directory specified.
     """
+    if strategy not in CLONE_STRATEGIES:
+        raise ValueError(
+            "Unknown clone strategy {}; must be one of {}".format(
+                strategy, ", ".join(CLONE_STRATEGIES)
+            )
+        )
+    if strategy == "sparse" and not sparse_patterns:
+        raise ValueError("The sparse clone strategy requires file patterns")
+
+    clone_args = []
+    if strategy == "shallow":
+        clone_args.extend(["--depth", "1"])
+    elif strategy == "blobless":
+        clone_args.append("--filter=blob:none")
+    elif strategy == "sparse":
+        clone_args.extend(["--filter=blob:none", "--sparse"])
+    if reference is not None:
+        clone_args.extend(["--reference-if-able", os.fspath(reference)])
 
     try:
         # first, check that local git set up with ssh keys for github
         check_git_ssh()
-        url = "git@github.com:{}/{}.git".format(organization, repo)
+        url = _github_url(organization, repo)
         print("cloning:", url)
-        _call_git("-C", dest_dir, "clone", url)
+        _call_git("-C", dest_dir, "clone", *clone_args, url, repo)
+        if strategy == "sparse":
+            _call_git(
+                "sparse-checkout",
+                "set",
+                "--no-cone",
+                *sparse_patterns,
+                directory=os.path.join(dest_dir, repo),
+            )
     except RuntimeError as e:
         raise e
 
 
+def update_mirror(organization, repo, mirror_dir):
+    """Create or update a local bare mirror of a GitHub repository, e.g. to
+    use as the reference repository for clone_repo.
+
+    Raises RuntimeError if ssh keys not set up correctly, or if the clone
+    or fetch fails.
+
+    Parameters
+    ----------
+    organization : string
+        A string with the name of the organization the repo lives in
+    repo : string
+        A string with the name of the GitHub repository to mirror
+    mirror_dir : path
+        Path to the local mirror. Created if it does not exist.
+    """
+    check_git_ssh()
+    if os.path.isdir(mirror_dir):
+        _call_git("fetch", "--prune", "origin", directory=mirror_dir)
+    else:
+        url = _github_url(organization, repo)
+        _call_git("clone", "--mirror", url, os.fspath(mirror_dir))
+
+
+def blob_hash(path):
+    """Computes the git object id of the file at path (the same value as
+    ``git hash-object path``), without running git.
+    """
+    sha = hashlib.sha1()
+    sha.update("blob {}\0".format(os.path.getsize(path)).encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def list_files(directory, rev="HEAD"):
+    """Lists the files in commit `rev` of the repository in directory,
+    using ``git ls-tree`` (so the working tree is never read).
+
+    Returns
+    -------
+    list of tuples
+        (path, object id) for every file, with paths relative to the top of
+        the repository. Symbolic links and submodules are not included.
+    """
+    ret = _call_git("ls-tree", "-r", "-z", rev, directory=directory)
+    files = []
+    for record in ret.stdout.split("\0"):
+        if not record:
+            continue
+        info, path = record.split("\t", 1)
+        mode, object_type, object_id = info.split()
+        if object_type == "blob" and mode != "120000":
+            files.append((path, object_id))
+    return files
+
+
+def write_blobs(directory, blobs):
+    """Writes the contents of git objects in the repository in directory to
+    files, streaming them all through a single ``git cat-file --batch``
+    process rather than running git once per file.
+
+    Parameters
+    ----------
+    directory : path
+        Path to the local repository.
+    blobs : list of tuples
+        (object id, destination path) for each file to write. Existing
+        destination files are overwritten.
+    """
+    if not blobs:
+        return
+    proc = subprocess.Popen(
+        ["git", "cat-file", "--batch"],
+        cwd=directory,
+        env=_git_env(),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        for object_id, dest in blobs:
+            proc.stdin.write(object_id.encode() + b"\n")
+            proc.stdin.flush()
+            header = proc.stdout.readline().split()
+            if len(header) != 3:
+                raise RuntimeError(
+                    "Could not read object {} in {}".format(
+                        object_id, directory
+                    )
+                )
+            remaining = int(header[2])
+            with open(dest, "wb") as f:
+                while remaining > 0:
+                    chunk = proc.stdout.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise RuntimeError(
+                            "Unexpected end of output from git cat-file"
+                        )
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            # each object is followed by a newline
+            proc.stdout.read(1)
+    finally:
+        proc.stdin.close()
+        proc.stdout.close()
+        proc.wait()
+
+
+# Maximum number of ``git cat-file --batch-check`` processes kept open at
+# once (one per repository). See object_info.
+CAT_FILE_POOL_SIZE = 8
+_cat_file_pool = collections.OrderedDict()
+_cat_file_pool_lock = threading.Lock()
+
+
+class _CatFileProcess:
+    """A long running ``git cat-file --batch-check`` process for one
+    repository, which answers object and ref queries without starting a new
+    git process for each one."""
+
+    def __init__(self, directory):
+        self.lock = threading.Lock()
+        self.proc = subprocess.Popen(
+            ["git", "cat-file", "--batch-check"],
+            cwd=directory,
+            env=_git_env(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def query(self, name):
+        """Returns the output line for name, or None if the process has
+        exited (e.g. because directory is not a git repository)."""
+        with self.lock:
+            try:
+                self.proc.stdin.write(name.encode() + b"\n")
+                self.proc.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                return None
+            line = self.proc.stdout.readline()
+        if not line:
+            return None
+        return line.decode().split()
+
+    def close(self):
+        with self.lock:
+            for stream in (self.proc.stdin, self.proc.stdout):
+                try:
+                    stream.close()
+                except BrokenPipeError:
+                    pass
+            self.proc.wait()
+
+
+def _cat_file_process(directory, restart=False):
+    """Gets the cat-file process for directory from the pool, starting one
+    if needed and closing the least recently used process if the pool is
+    full."""
+    key = os.path.abspath(directory)
+    stale = []
+    with _cat_file_pool_lock:
+        proc = _cat_file_pool.pop(key, None)
+        if restart and proc is not None:
+            stale.append(proc)
+            proc = None
+        if proc is None:
+            proc = _CatFileProcess(key)
+        _cat_file_pool[key] = proc
+        while len(_cat_file_pool) > CAT_FILE_POOL_SIZE:
+            stale.append(_cat_file_pool.popitem(last=False)[1])
+    for old in stale:
+        old.close()
+    return proc
+
+
+def object_info(directory, name):
+    """Looks up an object or ref in the repository in directory through a
+    persistent ``git cat-file --batch-check`` process, so that repeated
+    queries do not each start a git process.
+
+    Parameters
+    ----------
+    directory : path
+        Path to the local repository.
+    name : string
+        An object id, ref (e.g. ``refs/heads/main``) or other revision.
+
+    Returns
+    -------
+    tuple or None
+        (object id, object type) if the object exists, otherwise None.
+    """
+    fields = _cat_file_process(directory).query(name)
+    if fields is None:
+        # the process exited; try once more with a new one in case the
+        # repository was created or moved since it started
+        fields = _cat_file_process(directory, restart=True).query(name)
+    if fields is None or len(fields) != 3:
+        return None
+    return fields[0], fields[1]
+
+
+def ref_exists(directory, ref):
+    """Returns True if ref (a full ref name such as ``refs/heads/main``)
+    exists in the repository in directory. See object_info."""
+    return object_info(directory, ref) is not None
+
+
+def close_cat_file_processes(directory=None):
+    """Closes the persistent cat-file process for directory, or all of them
+    if directory is None. Processes are started again when needed."""
+    with _cat_file_pool_lock:
+        if directory is None:
+            stale = list(_cat_file_pool.values())
+            _cat_file_pool.clear()
+        else:
+            stale = [_cat_file_pool.pop(os.path.abspath(directory), None)]
+    for proc in stale:
+        if proc is not None:
+            proc.close()
+
+
+atexit.register(close_cat_file_processes)
+
+
+def _github_url(organization, repo):
+    return "git@github.com:{}/{}.git".format(organization, repo)
+
+
 def add_remote(directory, organization, remote_repo):
-    remote_url = "git@github.com:{}/{}.git".format(organization, remote_repo)
+    remote_url = _github_url(organization, remote_repo)
     _call_git("remote", "add", "origin", remote_url, directory=directory)
 
 
+def remote_head(organization, repo, branch="main"):
+    """Get the commit that `branch` points to in a GitHub repository,
+    without cloning or fetching anything (uses ``git ls-remote``).
+
+    Raises RuntimeError if ssh keys not set up correctly, or if the
+    repository can not be read.
+
+    Parameters
+    ----------
+    organization : string
+        A string with the name of the organization the repo lives in
+    repo : string
+        A string with the name of the GitHub repository
+    branch : str
+        The branch to look up. Default = main
+
+    Returns
+    -------
+    string
+        The commit SHA, or None if the branch does not exist.
+    """
+    check_git_ssh()
+    ret = _call_git(
+        "ls-remote", _github_url(organization, repo), "refs/heads/" + branch
+    )
+    fields = ret.stdout.split()
+    if not fields:
+        return None
+    return fields[0]
+
+
+def head_commit(directory):
+    """Get the commit SHA of HEAD for the repository in directory."""
+    return _backend["current"].head_commit(directory)
+
+
 def repo_changed(directory):
     """Determine if the Git repository in directory is dirty"""
-    ret = _call_git("status", "--porcelain", directory=directory)
-    return bool(ret.stdout)
+    return _backend["current"].is_dirty(directory)
 
 
-def commit_all_changes(directory, msg=None):
+def commit_all_changes(directory, msg=None, quiet=False):
     """Run git add, git commit on a given directory. Checks git status
-    first and does nothing if no changes.
+    first and does nothing if no changes (printing a message about it,
+    unless quiet is True).
+
+    Returns True if a commit was made, False if there were no changes.
     """
     if msg is None:
         raise ValueError("Commit message can not be empty.")
     if repo_changed(directory):
-        _call_git("add", "*", directory=directory)
-        _call_git("commit", "-a", "-m", msg, directory=directory)
+        _backend["current"].commit_all(directory, msg)
+        return True
     else:
-        print("No changes in repository {}; doing nothing".format(directory))
+        if not quiet:
+            print(
+                "No changes in repository {}; doing nothing".format(directory)
+            )
+        return False
 
 
 def init_and_commit(directory, commit_message):
@@ -181,35 +657,15 @@ def _master_branch_to_main(dir):
     the default branch to 'main', we need the local repo to match
     in order to be able to push without errors later.
     """
-
-    try:
-        # first, verify if the  master branch exists (this is only true
-        # if there are commits on the master branch)
-        _call_git(
-            "show-ref",
-            "--quiet",
-            "--verify",
-            "refs/heads/master",
-            directory=dir,
-        )
-    except RuntimeError:
-        # master branch verification fails, so we check for main and create
-        # it if it does not exist
-        try:
-            _call_git(
-                "show-ref",
-                "--quiet",
-                "--verify",
-                "refs/heads/main",
-                directory=dir,
-            )
-        except RuntimeError:
-            # no main branch, create one
-            _call_git("checkout", "-b", "main", directory=dir)
-    else:
+    backend = _backend["current"]
+    # the master branch only exists if there are commits on it
+    if backend.branch_exists(dir, "master"):
         # rename branch
         print("master exists, renaming")
-        _call_git("branch", "-m", "master", "main", directory=dir)
+        backend.rename_branch(dir, "master", "main")
+    elif not backend.branch_exists(dir, "main"):
+        # no main branch, create one
+        backend.create_branch(dir, "main")
 
 
 def push_to_github(directory, branch="main"):
@@ -265,4 +721,173 @@ def pull_from_github(directory, branch="main"):
 
 def git_init(directory, defaultbranch="main"):
     """Initialize git repository"""
-    _call_git("init", directory=directory)
+    _backend["current"].init(directory)
+
+
+class SubprocessGitBackend:
+    """Runs local git operations with the git command line program. This is
+    the default backend."""
+
+    name = "subprocess"
+
+    def init(self, directory):
+        _call_git("init", directory=directory)
+        # the repository may have been deleted and re-created since a
+        # cat-file process was started for this directory
+        close_cat_file_processes(directory)
+
+    def is_dirty(self, directory):
+        ret = _call_git("status", "--porcelain", directory=directory)
+        return bool(ret.stdout)
+
+    def commit_all(self, directory, message):
+        _call_git("add", "*", directory=directory)
+        _call_git("commit", "-a", "-m", message, directory=directory)
+
+    def branch_exists(self, directory, branch):
+        return ref_exists(directory, "refs/heads/" + branch)
+
+    def rename_branch(self, directory, old, new):
+        _call_git("branch", "-m", old, new, directory=directory)
+
+    def create_branch(self, directory, branch):
+        _call_git("checkout", "-b", branch, directory=directory)
+
+    def head_commit(self, directory):
+        ret = _call_git("rev-parse", "HEAD", directory=directory)
+        return ret.stdout.strip()
+
+
+class DulwichGitBackend:
+    """Runs local git operations in this process with the dulwich library,
+    which avoids starting a git process for every status, add, commit and
+    branch operation. Cloning, pulling and pushing still use the git
+    command line program.
+
+    Requires dulwich (``pip install abc-classroom[dulwich]``). Commits use
+    the same author as git would (user.name and user.email from the git
+    config, or the GIT_AUTHOR_* / GIT_COMMITTER_* environment variables).
+    """
+
+    name = "dulwich"
+
+    def __init__(self):
+        try:
+            from dulwich import porcelain
+            from dulwich.repo import Repo
+        except ImportError as e:
+            raise ImportError(
+                "The dulwich git backend requires dulwich. Install it with "
+                "'pip install abc-classroom[dulwich]', or set git_backend to "
+                "subprocess in config.yml."
+            ) from e
+        self._porcelain = porcelain
+        self._repo_class = Repo
+
+    def _open(self, directory):
+        return self._repo_class(os.fspath(directory))
+
+    def init(self, directory):
+        # like git init, this is safe to run on an existing repository
+        if not os.path.isdir(os.path.join(directory, ".git")):
+            self._repo_class.init(os.fspath(directory)).close()
+
+    def _status(self, directory):
+        with self._open(directory) as repo:
+            return self._porcelain.status(repo, untracked_files="all")
+
+    def is_dirty(self, directory):
+        status = self._status(directory)
+        return bool(
+            any(status.staged.values()) or status.unstaged or status.untracked
+        )
+
+    def commit_all(self, directory, message):
+        status = self._status(directory)
+        to_add = []
+        to_remove = []
+        for path in list(status.unstaged) + list(status.untracked):
+            if isinstance(path, bytes):
+                path = os.fsdecode(path)
+            full_path = os.path.join(directory, path)
+            if os.path.lexists(full_path):
+                to_add.append(os.path.abspath(full_path))
+            else:
+                to_remove.append(path)
+        with self._open(directory) as repo:
+            if to_add:
+                self._porcelain.add(repo, to_add)
+            if to_remove:
+                self._porcelain.remove(repo, to_remove, cached=True)
+            self._porcelain.commit(repo, message=message.encode())
+
+    def branch_exists(self, directory, branch):
+        with self._open(directory) as repo:
+            return _branch_ref(branch) in repo.refs
+
+    def rename_branch(self, directory, old, new):
+        old_ref = _branch_ref(old)
+        new_ref = _branch_ref(new)
+        with self._open(directory) as repo:
+            repo.refs[new_ref] = repo.refs[old_ref]
+            del repo.refs[old_ref]
+            if repo.refs.get_symrefs().get(b"HEAD") == old_ref:
+                repo.refs.set_symbolic_ref(b"HEAD", new_ref)
+
+    def create_branch(self, directory, branch):
+        new_ref = _branch_ref(branch)
+        with self._open(directory) as repo:
+            # in a repository with no commits yet, this just points HEAD at
+            # the new (unborn) branch, like git checkout -b
+            head = repo.refs.follow(b"HEAD")[1]
+            if head is not None:
+                repo.refs[new_ref] = head
+            repo.refs.set_symbolic_ref(b"HEAD", new_ref)
+
+    def head_commit(self, directory):
+        with self._open(directory) as repo:
+            return repo.head().decode()
+
+
+def _branch_ref(branch):
+    return b"refs/heads/" + branch.encode()
+
+
+# Backends for local git operations (init, status, add, commit and branch
+# changes), by the name used for git_backend in config.yml
+GIT_BACKENDS = {
+    SubprocessGitBackend.name: SubprocessGitBackend,
+    DulwichGitBackend.name: DulwichGitBackend,
+}
+
+# The backend used by the module level functions. See use_git_backend.
+_backend = {"current": SubprocessGitBackend()}
+
+
+@contextlib.contextmanager
+def use_git_backend(name=None):
+    """Context manager that runs local git operations (git_init,
+    repo_changed, commit_all_changes, init_and_commit and head_commit) with
+    the named backend inside the ``with`` block, and restores the previous
+    backend afterwards.
+
+    Parameters
+    ----------
+    name : string (default = None)
+        One of GIT_BACKENDS. If None, keeps the current backend.
+    """
+    if name is None:
+        yield _backend["current"]
+        return
+    if name not in GIT_BACKENDS:
+        raise ValueError(
+            "Unknown git backend {}; must be one of {}".format(
+                name, ", ".join(GIT_BACKENDS)
+            )
+        )
+    previous = _backend["current"]
+    _backend["current"] = GIT_BACKENDS[name]()
+    try:
+        yield _backend["current"]
+    finally:
+        _backend["current"] = previous
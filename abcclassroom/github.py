@@ -7,8 +7,34 @@ abc-classroom.github
 # related to setting up authorization and git.py
 # for command line git operations.
 
+import threading
+
 import github3 as gh3
 
+from . import utils
+
+# Logged in github3 clients, by token. See get_client.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(token):
+    """Returns a github3 GitHub object logged in with token. The client is
+    created on first use and then shared by every call with the same token,
+    and its connections come from the pool shared with utils.get_session.
+
+    Returns None if token is None (like github3.login).
+    """
+    with _clients_lock:
+        client = _clients.get(token)
+        if client is None:
+            client = gh3.login(token=token)
+            if client is None:
+                return None
+            utils.mount_http_adapter(client.session)
+            _clients[token] = client
+        return client
+
 
 def remote_repo_exists(org, repository, token=None):
     """Check if the remote repository exists for the organization.
@@ -28,7 +54,7 @@ def remote_repo_exists(org, repository, token=None):
     """
 
     try:
-        g = gh3.login(token=token)
+        g = get_client(token)
         g.repository(org, repository)
 
     except Exception:
@@ -39,7 +65,7 @@ def remote_repo_exists(org, repository, token=None):
 
 def create_repo(org, repository, token):
     """Create a repository in the provided GitHub organization."""
-    github_obj = gh3.login(token=token)
+    github_obj = get_client(token)
     organization = github_obj.organization(org)
     print(
         "Creating new repository {} at https://github.com/{}".format(
@@ -56,6 +82,38 @@ def create_repo(org, repository, token):
         )
 
 
+def list_assignment_repos(org, assignment, token):
+    """List the repositories for an assignment in the provided GitHub
+    organization, i.e. every repository whose name starts with
+    ``<assignment>-``. Fetches the whole list of repositories in the
+    organization in one paginated sweep of the API, rather than asking
+    about each repository separately.
+
+    Parameters
+    ----------
+    org : string
+        Name of the organization where the repos live on GitHub.
+    assignment : string
+        Name of the assignment.
+    token : string
+        Token value required for authentication
+
+    Returns
+    -------
+    set
+        Names of the matching repositories, in lower case (GitHub
+        repository names are not case sensitive).
+    """
+    github_obj = get_client(token)
+    prefix = "{}-".format(assignment).lower()
+    repo_names = set()
+    for repo in github_obj.organization(org).repositories(number=-1):
+        name = repo.name.lower()
+        if name.startswith(prefix):
+            repo_names.add(name)
+    return repo_names
+
+
 ###################################################
 # Methods below are from before the re-factoring.
 # Retaining for reference, but with no guarantee
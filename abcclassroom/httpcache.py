@@ -0,0 +1,213 @@
+"""
+abc-classroom.httpcache
+=======================
+"""
+
+# An on-disk cache for reads from the GitHub API. See utils.get_session for
+# where it is used.
+
+import base64
+import hashlib
+import os
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import utils
+from .ratelimit import RateLimitedAdapter
+
+# Entries not used for this long (in seconds) are removed
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+# Total size of the cache (in bytes) before the least recently used entries
+# are removed
+DEFAULT_MAX_SIZE = 20 * 1024 * 1024
+# Check whether entries need to be removed after this many new entries
+_EVICT_EVERY = 50
+
+
+def default_cache_dir():
+    """Directory for the cache: abc-classroom/http in $XDG_CACHE_HOME, or in
+    ~/.cache if that is not set."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(
+        "~/.cache"
+    )
+    return os.path.join(cache_home, "abc-classroom", "http")
+
+
+class CachingAdapter(RateLimitedAdapter):
+    """HTTP adapter that caches the responses to GET requests that have an
+    ETag or Last-Modified header, and sends conditional requests
+    (If-None-Match / If-Modified-Since) for URLs that are in the cache. If
+    the server answers 304 Not Modified, the cached response is returned.
+    GitHub does not count 304 responses against the API rate limit.
+
+    Responses are cached per URL, token (Authorization header) and Accept
+    header. Entries that have not been used for max_age seconds are removed,
+    as are the least recently used entries once the cache is larger than
+    max_size bytes.
+
+    Requests that do go to GitHub (including conditional ones) are paced
+    by the rate limiter of RateLimitedAdapter.
+
+    Parameters
+    ----------
+    cache_dir : path (default = None)
+        Where to keep the cache. If None, uses default_cache_dir().
+    max_age : number (default = DEFAULT_MAX_AGE)
+        Seconds that an unused entry is kept.
+    max_size : int (default = DEFAULT_MAX_SIZE)
+        Maximum total size of the cache in bytes.
+    **kwargs
+        Passed on to RateLimitedAdapter.
+    """
+
+    def __init__(
+        self,
+        cache_dir=None,
+        max_age=DEFAULT_MAX_AGE,
+        max_size=DEFAULT_MAX_SIZE,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._stored = 0
+        self._lock = threading.Lock()
+
+    def send(self, request, stream=False, **kwargs):
+        if request.method != "GET" or stream:
+            return super().send(request, stream=stream, **kwargs)
+
+        path = self._entry_path(request)
+        entry = utils.read_json_file(path)
+        if entry:
+            request = request.copy()
+            if entry.get("etag"):
+                request.headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = super().send(request, stream=stream, **kwargs)
+
+        if entry and response.status_code == 304:
+            with self._lock:
+                self.hits += 1
+            self._touch(path)
+            return self._cached_response(request, response, entry)
+
+        with self._lock:
+            self.misses += 1
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status_code == 200 and (etag or last_modified):
+            self._store(path, response, etag, last_modified)
+        return response
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        for name, _, _ in self._entries():
+            _remove(os.path.join(self.cache_dir, name))
+
+    def evict(self):
+        """Removes entries that are older than max_age, then the least
+        recently used entries until the cache is no larger than max_size.
+        """
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        now = time.time()
+        total = sum(size for _, _, size in entries)
+        for name, used_at, size in entries:
+            if now - used_at <= self.max_age and total <= self.max_size:
+                break
+            _remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+    def _entry_path(self, request):
+        key = "\n".join(
+            [
+                request.url,
+                request.headers.get("Authorization", ""),
+                request.headers.get("Accept", ""),
+            ]
+        )
+        name = hashlib.sha256(key.encode()).hexdigest() + ".json"
+        return os.path.join(self.cache_dir, name)
+
+    def _entries(self):
+        """(file name, last used time, size) for every cache entry."""
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                info = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((name, info.st_mtime, info.st_size))
+        return entries
+
+    def _store(self, path, response, etag, last_modified):
+        entry = {
+            "url": response.url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": dict(response.headers),
+            "encoding": response.encoding,
+            "body": base64.b64encode(response.content).decode("ascii"),
+        }
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            utils.write_json_file(path, entry)
+        except OSError:
+            # the cache is only an optimization
+            return
+        with self._lock:
+            self._stored += 1
+            evict = self._stored % _EVICT_EVERY == 1
+        if evict:
+            self.evict()
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _cached_response(self, request, not_modified, entry):
+        """Builds a 200 response from a cache entry. Headers in the 304
+        response (e.g. the current rate limit) replace the cached ones."""
+        entry_body = base64.b64decode(entry["body"])
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        for name, value in not_modified.headers.items():
+            if name.lower() != "content-length":
+                response.headers[name] = value
+        # the body is stored decoded
+        response.headers.pop("Content-Encoding", None)
+        response.headers["Content-Length"] = str(len(entry_body))
+        response._content = entry_body
+        response.encoding = entry.get("encoding")
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.from_cache = True
+        return response
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
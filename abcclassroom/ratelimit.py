@@ -0,0 +1,281 @@
+"""
+abc-classroom.ratelimit
+=======================
+"""
+
+# Pacing of GitHub API requests. Every request to GitHub goes through the
+# adapter shared by all sessions (see utils.get_http_adapter), which is a
+# RateLimitedAdapter.
+
+import hashlib
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests.adapters
+
+# Waits longer than this (in seconds) are announced, so that a command that
+# is waiting for the rate limit does not look like it has hung
+ANNOUNCE_WAIT = 5
+
+
+def budget_key(request, response=None):
+    """The rate limit budget that a request counts against: GitHub keeps a
+    separate budget for each token (or for unauthenticated requests) and
+    each resource (core, search, graphql, ...). The resource is taken from
+    the X-RateLimit-Resource header of the response if there is one, and
+    otherwise guessed from the URL.
+
+    Returns a tuple of a short id for the token (not the token itself;
+    None for unauthenticated requests) and the resource.
+    """
+    auth = request.headers.get("Authorization")
+    token_id = None
+    if auth:
+        token_id = hashlib.sha256(auth.encode()).hexdigest()[:12]
+    resource = None
+    if response is not None:
+        resource = response.headers.get("X-RateLimit-Resource")
+    if resource is None:
+        path = urlsplit(request.url).path
+        if path.startswith("/search/code"):
+            resource = "code_search"
+        elif path.startswith("/search/"):
+            resource = "search"
+        elif path.startswith("/graphql"):
+            resource = "graphql"
+        else:
+            resource = "core"
+    return token_id, resource
+
+
+class _Budget:
+    """What we know about one rate limit budget."""
+
+    __slots__ = ("limit", "remaining", "reset", "blocked_until")
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.blocked_until = 0.0
+
+
+class RateLimiter:
+    """Keeps track of the GitHub API rate limits from the X-RateLimit-*
+    headers of each response, and works out how long to wait before the
+    next request. A separate budget is kept for each key (see budget_key),
+    so that e.g. unauthenticated requests or searches do not slow down
+    requests made with a token.
+
+    As long as plenty of a budget is left, requests are not delayed. Once
+    fewer than min_remaining requests are left (or a tenth of the limit, if
+    that is smaller), requests are spread out evenly until the budget
+    resets; if it runs out, requests wait for the reset, however long that
+    is. Responses that say the (primary or secondary) rate limit was hit
+    are retried after the time given in Retry-After or X-RateLimit-Reset,
+    or else after an exponential backoff with random jitter.
+
+    Parameters
+    ----------
+    min_remaining : int (default = 50)
+        Start spreading out requests when fewer than this many are left.
+    max_retries : int (default = 5)
+        How many times to retry a request that hit the rate limit.
+    backoff : number (default = 1)
+        Seconds to wait before the first retry when GitHub does not say how
+        long to wait. Doubles with every retry, up to max_backoff.
+    max_backoff : number (default = 60)
+        Longest time (in seconds) to back off when GitHub does not say how
+        long to wait. Waits that GitHub asks for are not limited.
+    """
+
+    def __init__(
+        self,
+        min_remaining=50,
+        max_retries=5,
+        backoff=1,
+        max_backoff=60,
+        clock=time.time,
+        sleep=time.sleep,
+    ):
+        self.min_remaining = min_remaining
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._budgets = {}
+        self.requests = 0
+        self.retries = 0
+        self.waited = 0.0
+        # end of the last wait that was announced
+        self._announced_until = 0.0
+
+    def stats(self):
+        """Returns the current budgets and usage counters: the rate limit,
+        requests remaining and when the budget resets (as reported by
+        GitHub) for each key in "budgets", and for the budget with the
+        fewest requests remaining at the top level, plus the number of
+        requests and retries made and the total seconds spent waiting."""
+        with self._lock:
+            budgets = {
+                key: {
+                    "limit": b.limit,
+                    "remaining": b.remaining,
+                    "reset": b.reset,
+                }
+                for key, b in self._budgets.items()
+            }
+            known = [b for b in budgets.values() if b["remaining"] is not None]
+            lowest = min(
+                known,
+                key=lambda b: b["remaining"],
+                default={"limit": None, "remaining": None, "reset": None},
+            )
+            return dict(
+                lowest,
+                budgets=budgets,
+                requests=self.requests,
+                retries=self.retries,
+                waited=self.waited,
+            )
+
+    def wait(self, key=None):
+        """Waits as long as needed before sending the next request that
+        counts against the budget for key."""
+        with self._lock:
+            now = self._clock()
+            delay = self._delay(self._budget(key))
+            self.requests += 1
+            if delay > 0:
+                self.waited += delay
+            # parallel requests usually wait for the same reset; only
+            # announce it once
+            announce = (
+                delay > ANNOUNCE_WAIT
+                and now + delay > self._announced_until + ANNOUNCE_WAIT
+            )
+            if announce:
+                self._announced_until = now + delay
+        if announce:
+            print(
+                "GitHub API rate limit reached; waiting {:.0f} seconds "
+                "(until {})".format(
+                    delay,
+                    time.strftime("%H:%M:%S", time.localtime(now + delay)),
+                )
+            )
+        if delay > 0:
+            self._sleep(delay)
+
+    def _budget(self, key):
+        budget = self._budgets.get(key)
+        if budget is None:
+            budget = self._budgets[key] = _Budget()
+        return budget
+
+    def _delay(self, budget):
+        now = self._clock()
+        delay = max(budget.blocked_until - now, 0)
+        if budget.remaining is not None and budget.reset is not None:
+            until_reset = max(budget.reset - now, 0)
+            min_remaining = self.min_remaining
+            if budget.limit:
+                min_remaining = min(min_remaining, budget.limit // 10)
+            if budget.remaining <= 0:
+                delay = max(delay, until_reset)
+            elif budget.remaining < min_remaining:
+                delay = max(delay, until_reset / budget.remaining)
+                # one fewer until we hear from GitHub again
+                budget.remaining -= 1
+        return delay
+
+    def update(self, response, key=None):
+        """Records the rate limit headers of a response to a request that
+        counted against the budget for key."""
+        headers = response.headers
+        with self._lock:
+            budget = self._budget(key)
+            try:
+                if "X-RateLimit-Limit" in headers:
+                    budget.limit = int(headers["X-RateLimit-Limit"])
+                if "X-RateLimit-Remaining" in headers:
+                    budget.remaining = int(headers["X-RateLimit-Remaining"])
+                if "X-RateLimit-Reset" in headers:
+                    budget.reset = int(headers["X-RateLimit-Reset"])
+            except ValueError:
+                pass
+
+    def retry_delay(self, response, attempt, key=None):
+        """Returns how many seconds to wait before retrying the request of
+        response, or None if it should not be retried (it did not hit the
+        rate limit, or it has been retried max_retries times already)."""
+        if attempt >= self.max_retries or not _rate_limited(response):
+            return None
+        now = self._clock()
+        with self._lock:
+            budget = self._budget(key)
+            reset = budget.reset
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            delay = int(retry_after)
+        elif response.headers.get("X-RateLimit-Remaining") == "0" and (
+            reset is not None
+        ):
+            delay = max(reset - now, 0)
+        else:
+            delay = min(self.backoff * 2**attempt, self.max_backoff)
+        # jitter, so that parallel requests do not all retry at once
+        delay = delay * random.uniform(1, 1.25)
+        with self._lock:
+            self.retries += 1
+            budget.blocked_until = max(budget.blocked_until, now + delay)
+        return delay
+
+
+def _rate_limited(response):
+    """Whether GitHub refused the request because of a rate limit."""
+    if response.status_code == 429:
+        return True
+    if response.status_code != 403:
+        return False
+    if "Retry-After" in response.headers:
+        return True
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        return True
+    return b"rate limit" in response.content.lower()
+
+
+class RateLimitedAdapter(requests.adapters.HTTPAdapter):
+    """HTTP adapter that sends every request through a RateLimiter, and
+    retries requests that hit the rate limit.
+
+    Parameters
+    ----------
+    rate_limiter : RateLimiter (default = None)
+        If None, a new RateLimiter with the default settings.
+    **kwargs
+        Passed on to requests.adapters.HTTPAdapter.
+    """
+
+    def __init__(self, rate_limiter=None, **kwargs):
+        super().__init__(**kwargs)
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
+        self.rate_limiter = rate_limiter
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            self.rate_limiter.wait(budget_key(request))
+            response = super().send(request, **kwargs)
+            key = budget_key(request, response)
+            self.rate_limiter.update(response, key)
+            if self.rate_limiter.retry_delay(response, attempt, key) is None:
+                return response
+            # the delay is applied by wait() before the next attempt
+            response.close()
+            attempt += 1
@@ -3,14 +3,101 @@ abc-classroom.scrub-feedback
 ============================
 """
 
+import os
 import re
-import codecs
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from . import config as cf
 
 # This approach borrowed
 # from https://github.com/jupyter/nbgrader/issues/1156#issuecomment-502097507
 
+# Begin and end markers around hidden tests in the html report. Matches any
+# number of # signs, extra whitespace and any of the Pygments comment classes
+# (c1, c, cm, ch, cs, ...), since the html depends on how the test cell was
+# written and which Pygments version nbgrader used.
+_HIDDEN_TESTS_MARKER = re.compile(
+    rb'<span class="c[a-z0-9]{0,3}">'
+    rb"[ \t]{0,8}#{1,8}[ \t]{0,8}(BEGIN|END)[ \t]{1,8}HIDDEN[ \t]{1,8}TESTS"
+    rb"[ \t]{0,8}</span>"
+)
+# No marker is longer than this. We keep this many bytes from the end of
+# each chunk to search again with the next one, so that markers that span
+# two chunks are still found.
+_MAX_MARKER_LENGTH = 128
+_CHUNK_SIZE = 1024 * 1024
+# Added to the end of every scrubbed report, so that we can tell that a
+# report has already been scrubbed without reading all of it
+SCRUBBED_MARKER = b"\n<!-- hidden tests removed by abc-classroom -->\n"
+
+
+def scrub_assignment(assignment_name, jobs=None):
+    """Scrubs hidden tests from the feedback reports of every student for an
+    assignment, i.e. every course_materials/feedback/student/assignment/*.html
+    file. Reports are scrubbed in parallel in a pool of processes. Reports
+    that have already been scrubbed are skipped.
+
+    Parameters
+    ----------
+    assignment_name : string
+        Name of the assignment. Must match the name of the directories in
+        course_materials/feedback.
+    jobs : int (default = None)
+        Number of reports to scrub at the same time. If None, uses the number
+        of CPUs.
+
+    Returns
+    -------
+    dict
+        Maps the path of each report that was scrubbed in this run to the
+        number of hidden test blocks removed from it.
+    """
+    print("Loading configuration from config.yml")
+    try:
+        config = cf.CourseConfig.load(required=("course_materials",))
+    except (FileNotFoundError, RuntimeError, KeyError, ValueError) as err:
+        print(err)
+        return {}
+
+    reports = sorted(
+        config.feedback_dir.glob("*/{}/*.html".format(assignment_name))
+    )
+    to_scrub = [r for r in reports if not is_scrubbed(r)]
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs <= 1 or len(to_scrub) <= 1:
+        removed = [scrub_feedback(r) for r in to_scrub]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            removed = list(executor.map(scrub_feedback, to_scrub))
 
-def scrub_feedback(html_path):
+    print(
+        "Scrubbed {} feedback reports for {} ({} hidden test blocks removed); "
+        "{} were already scrubbed".format(
+            len(to_scrub),
+            assignment_name,
+            sum(removed),
+            len(reports) - len(to_scrub),
+        )
+    )
+    return dict(zip(to_scrub, removed))
+
+
+def is_scrubbed(html_path):
+    """Checks whether scrub_feedback has already been run on the html file,
+    by looking for the marker it adds at the end of the file."""
+    try:
+        with open(html_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - len(SCRUBBED_MARKER), 0))
+            return f.read() == SCRUBBED_MARKER
+    except OSError:
+        return False
+
+
+def scrub_feedback(html_path, chunk_size=_CHUNK_SIZE, force=False):
     """Scrub out hidden tests from nbgrader html feedback pages.
 
     We use this to remove hidden tests given all of the nbgrader grade
@@ -18,47 +105,90 @@ def scrub_feedback(html_path):
     it is more work than expected to generate a nice custom report.
 
     This will remove all html between ### BEGIN HIDDEN TESTS and ### END
-    HIDDEN TESTS. Because I think we sometimes only use one # sign i may add a
-    second catch for this.
+    HIDDEN TESTS, with any number of # signs. A begin marker without a
+    matching end marker is left alone.
+
+    The file is read and scrubbed in chunks, so memory use does not depend
+    on the size of the report. The cleaned html is written to a temporary
+    file that then replaces the original. A comment is added at the end of
+    the file to mark it as scrubbed; files with this comment are not
+    scrubbed again (unless force is True).
 
     Parameters
     ----------
     html_path : string
         Path to HTML file to be cleaned.
+    chunk_size : int
+        Number of bytes to read at a time.
+    force : boolean (default = False)
+        Scrub the file even if it has already been scrubbed.
 
     Returns
     -------
-    html-file : A cleaned html file without the hidden tests.
-        The original file will be overwritten.
+    int
+        The number of hidden test blocks removed. The original file is
+        overwritten with the cleaned html.
     """
-    with codecs.open(html_path, "r") as html_file:
-        orig_html_feedback = html_file.read()
-
-    # Hide hidden tests
-    html_clean = re.sub(
-        r'<span class="c1">### BEGIN HIDDEN TESTS<\/span>[\w\W]*?'
-        r'<span class="c1">### END HIDDEN TESTS<\/span>',
-        "",
-        orig_html_feedback,
-    )
-    # Just in case we use just one pound sign
-    html_clean = re.sub(
-        r'<span class="c1"># BEGIN HIDDEN TESTS<\/span>[\w\W]*?'
-        r'<span class="c1"># END HIDDEN TESTS<\/span>',
-        "",
-        html_clean,
-    )
+    if not force and is_scrubbed(html_path):
+        return 0
+    html_dir = os.path.dirname(os.path.abspath(html_path))
+    fd, tmp_path = tempfile.mkstemp(dir=html_dir, suffix=".tmp")
+    try:
+        with open(html_path, "rb") as src, os.fdopen(fd, "wb") as dest:
+            removed = _scrub_stream(src, dest, chunk_size)
+            dest.write(SCRUBBED_MARKER)
+        shutil.copymode(html_path, tmp_path)
+        os.replace(tmp_path, html_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return removed
+
+
+def _scrub_stream(src, dest, chunk_size):
+    """Copies the binary file src to dest, leaving out hidden test blocks.
+    Makes a single pass over the file with one regular expression that
+    matches both begin and end markers. Returns the number of blocks
+    removed."""
+    buffer = b""
+    # position of buffer[0] in src
+    offset = 0
+    # position in src of the begin marker of the block we are in, if any
+    block_start = None
+    removed = 0
+
+    while True:
+        chunk = src.read(chunk_size)
+        buffer += chunk
+        pos = 0
+        for match in _HIDDEN_TESTS_MARKER.finditer(buffer):
+            start, end = match.span()
+            is_begin = match.group(1) == b"BEGIN"
+            if block_start is None:
+                if is_begin:
+                    dest.write(buffer[pos:start])
+                    block_start = offset + start
+                else:
+                    # end marker without a begin marker; keep it
+                    dest.write(buffer[pos:end])
+            elif not is_begin:
+                block_start = None
+                removed += 1
+            pos = end
+        if not chunk:
+            break
+        # keep enough of the end of the buffer to find a marker that
+        # continues into the next chunk
+        keep_from = max(len(buffer) - (_MAX_MARKER_LENGTH - 1), pos)
+        if block_start is None:
+            dest.write(buffer[pos:keep_from])
+        offset += keep_from
+        buffer = buffer[keep_from:]
 
-    # Not sure we will need this
-    # Hide the traceback (which includes parts of the hidden tests)
-    # html = re.sub(
-    #     r'(<div class="output_subarea output_text output_error">\n<pre>\n)
-    #     (?:(?!<\/div>)[\w\W])*(
-    #     <span class="ansi-red-intense-fg ansi-bold">[\w\W]*?<\/pre>)',
-    #     r'\1\2',
-    #     orig_html_feedback)
-
-    # Write the file - currently this overwrites the existing html output
-    # We could consider a different approach
-    with open(html_path, "w") as cleaned_html:
-        cleaned_html.write(html_clean)
+    if block_start is None:
+        dest.write(buffer[pos:])
+    else:
+        # no end marker, so copy the rest of the file as is
+        src.seek(block_start)
+        shutil.copyfileobj(src, dest)
+    return removed
@@ -3,8 +3,10 @@ abc-classroom.template
 ======================
 
 """
+import filecmp
 import os
 import shutil
+import tempfile
 from pathlib import Path
 
 from . import config as cf
@@ -31,12 +33,20 @@ def new_update_template(args):
     """
 
     try:
-        create_template(
-            mode=args.mode,
-            push_to_github=args.github,
-            commit_message=args.commit_message,
-            assignment_name=args.assignment,
-        )
+        if getattr(args, "all", False):
+            create_all_templates(
+                mode=args.mode,
+                push_to_github=args.github,
+                commit_message=args.commit_message,
+                jobs=args.jobs,
+            )
+        else:
+            create_template(
+                mode=args.mode,
+                push_to_github=args.github,
+                commit_message=args.commit_message,
+                assignment_name=args.assignment,
+            )
     except FileNotFoundError as fnfe:
         # if the assignment does not exist in course_materials/release
         print(fnfe)
@@ -72,7 +82,10 @@ def create_template(
     ----------
     push_to_github : boolean
         True if you want to push to GH
-    mode : merge, fail
+    mode : merge, fail, delete, sync
+        What to do if the template directory already exists; see
+        create_template_dir. With sync, only changed files are copied and
+        files that are no longer in the assignment are removed.
     commit_message : string
         Sets a custom git commit message. For new templates, default is
         "Initial commit" and for updating templates, default is
@@ -83,17 +96,163 @@ def create_template(
 
     print("Loading configuration from config.yml")
     try:
-        config = cf.get_config()
-    except (FileNotFoundError, RuntimeError) as err:
+        config = cf.CourseConfig.load(
+            required=("course_materials", "template_dir")
+            + (("organization",) if push_to_github else ())
+        )
+    except (FileNotFoundError, RuntimeError, KeyError, ValueError) as err:
         print(err)
         return
+    with abcgit.use_git_backend(config.git_backend):
+        template_repo_path = _build_template(
+            config, assignment_name, mode, commit_message
+        )
+
+    # Create / append assignment entry in config - this should only happen if
+    # the assignment above exists...
+    print("Updating assignment list in config")
+    cf.set_config_option(
+        config.config,
+        "assignments",
+        assignment_name,
+        append_value=True,
+        configpath=config.course_dir,
+    )
+
+    # Optional - push files to GitHub
+    if push_to_github:
+        repo_name = os.path.basename(template_repo_path)
+        token = auth.get_github_auth()["access_token"]
+
+        with abcgit.ssh_connection_sharing(config.ssh_multiplexing):
+            create_or_update_remote(
+                template_repo_path, config.organization, repo_name, token
+            )
+
+
+def create_all_templates(
+    mode="fail",
+    push_to_github=False,
+    commit_message="Initial commit",
+    jobs=1,
+):
+    """
+    Creates or updates the template repository of every assignment in
+    course_materials/release, in one go. Does the same as calling
+    create_template for each assignment, but reads the config and GitHub
+    token once, builds the local templates in parallel, and writes the
+    config file once at the end.
+
+    An assignment that fails (e.g. because its template directory exists
+    and mode is fail) is reported and skipped; the others still go ahead.
+
+    Parameters
+    ----------
+    mode : fail, merge, delete, sync
+        What to do with existing template directories; see create_template.
+    push_to_github : boolean
+        True if you want to create the remote repositories (if needed) and
+        push to GH
+    commit_message : string
+        The git commit message for every template.
+    jobs : int (default = 1)
+        Number of templates to build (and push) at the same time.
+
+    Returns
+    -------
+    dict
+        Maps each assignment name to None if it succeeded or to a message
+        saying what went wrong.
+    """
+
+    print("Loading configuration from config.yml")
+    try:
+        config = cf.CourseConfig.load(
+            required=("course_materials", "template_dir")
+            + (("organization",) if push_to_github else ())
+        )
+    except (FileNotFoundError, RuntimeError, KeyError, ValueError) as err:
+        print(err)
+        return {}
+    release_dir = config.release_dir
+    if not release_dir.is_dir():
+        raise FileNotFoundError(
+            "Oops, there is no release directory at {}".format(release_dir)
+        )
+    assignments = sorted(p.name for p in release_dir.iterdir() if p.is_dir())
+    if not assignments:
+        print("No assignments found in {}".format(release_dir))
+        return {}
+    token = None
+    if push_to_github:
+        token = auth.get_github_auth()["access_token"]
+
+    def _build(assignment_name):
+        try:
+            return _build_template(
+                config, assignment_name, mode, commit_message
+            )
+        except (OSError, RuntimeError) as e:
+            return e
+
+    with abcgit.use_git_backend(config.git_backend):
+        built = utils.map_in_pool(_build, assignments, jobs)
+    results = {}
+    template_paths = {}
+    for assignment_name, result in zip(assignments, built):
+        if isinstance(result, Exception):
+            results[assignment_name] = str(result)
+        else:
+            results[assignment_name] = None
+            template_paths[assignment_name] = result
+
+    if template_paths:
+        print("Updating assignment list in config")
+        existing = cf.get_config_option(config.config, "assignments", False)
+        if existing is None:
+            existing = []
+        elif not isinstance(existing, list):
+            existing = [existing]
+        new = [a for a in template_paths if a not in existing]
+        cf.set_config_option(
+            config.config,
+            "assignments",
+            existing + new,
+            configpath=config.course_dir,
+        )
+
+    if push_to_github and template_paths:
+
+        def _push(template_repo_path):
+            create_or_update_remote(
+                template_repo_path,
+                config.organization,
+                os.path.basename(template_repo_path),
+                token,
+            )
+
+        with abcgit.ssh_connection_sharing(config.ssh_multiplexing):
+            utils.map_in_pool(_push, list(template_paths.values()), jobs)
+
+    failed = {a: msg for a, msg in results.items() if msg is not None}
+    print(
+        "Created or updated {} of {} templates".format(
+            len(template_paths), len(assignments)
+        )
+    )
+    for assignment_name, msg in failed.items():
+        print(" {}: {}".format(assignment_name, msg))
+    return results
+
+
+def _build_template(config, assignment_name, mode, commit_message):
+    """Does the local part of create_template for one assignment: creates
+    or updates the template directory, copies the files into it and
+    commits them. Returns the path to the template repository. config is
+    a config.CourseConfig."""
     # Set up the path to the assignment files, which are in
     # course_dir/materials_dir/release/assignment_name
-    course_dir = cf.get_config_option(config, "course_directory", True)
-    materials_dir = cf.get_config_option(config, "course_materials", True)
-    # I think this should be moved above where it created the directory
-    parent_path = utils.get_abspath(materials_dir, course_dir)
-    release_path = Path(parent_path, "release", assignment_name)
+    release_path = config.release_path(assignment_name)
 
     # Check to see if there is an assignment with that name in the
     # release directory, if not, fail gracefully
@@ -112,34 +271,18 @@ def create_template(
     template_repo_path = create_template_dir(config, assignment_name, mode)
 
     # and copy files
-    copy_files_to_template_repo(
-        config, template_repo_path, assignment_name, release_path
-    )
+    if mode == "sync":
+        sync_template_repo(
+            config, template_repo_path, assignment_name, release_path
+        )
+    else:
+        copy_files_to_template_repo(
+            config, template_repo_path, assignment_name, release_path
+        )
 
     # Create the local git repository and commit changes
     abcgit.init_and_commit(template_repo_path, commit_message)
-
-    # Create / append assignment entry in config - this should only happen if
-    # the assignment above exists...
-    print("Updating assignment list in config")
-    course_dir = cf.get_config_option(config, "course_directory", True)
-    cf.set_config_option(
-        config,
-        "assignments",
-        assignment_name,
-        append_value=True,
-        configpath=course_dir,
-    )
-
-    # Optional - push files to GitHub
-    if push_to_github:
-        organization = cf.get_config_option(config, "organization", True)
-        repo_name = os.path.basename(template_repo_path)
-        token = auth.get_github_auth()["access_token"]
-
-        create_or_update_remote(
-            template_repo_path, organization, repo_name, token
-        )
+    return template_repo_path
 
 
 def create_or_update_remote(
@@ -192,13 +335,15 @@ def create_or_update_remote(
 def create_template_dir(config, assignment, mode="fail"):
     """
     Creates a new directory in template_dir that will become the template
-    repository for the assignment. If directory exists and mode is merge,
-    do nothing. If directory exists and mode is delete, remove contents but
-    leave .git directory.
+    repository for the assignment. If directory exists and mode is merge
+    or sync, do nothing. If directory exists and mode is delete, remove
+    contents but leave .git directory.
+
+    config can be a config.CourseConfig or a config dict from get_config().
     """
-    course_dir = cf.get_config_option(config, "course_directory", True)
-    template_parent_dir = cf.get_config_option(config, "template_dir", True)
-    parent_path = Path(utils.get_abspath(template_parent_dir, course_dir))
+    config = cf.course_config(config, required=("template_dir",))
+    course_dir = config.course_dir
+    parent_path = config.template_dir
 
     # check that parent directory for templates exists, and create it
     # if it does not
@@ -208,10 +353,10 @@ def create_template_dir(config, assignment, mode="fail"):
                 parent_path.relative_to(course_dir)
             )
         )
-        parent_path.mkdir()
+        # another template may be creating it at the same time
+        parent_path.mkdir(exist_ok=True)
 
-    repo_name = assignment + "-template"
-    template_path = Path(parent_path, repo_name)
+    template_path = config.template_path(assignment)
     dir_exists = template_path.is_dir()
     if not dir_exists:
         template_path.mkdir()
@@ -225,7 +370,8 @@ def create_template_dir(config, assignment, mode="fail"):
             raise FileExistsError(
                 "Oops! The directory specified: {} already exists "
                 "for this course; "
-                "re-run with --mode merge' or '--mode delete', "
+                "re-run with --mode merge', '--mode sync' or "
+                "'--mode delete', "
                 "or delete / move directory before re-running"
                 ". ".format(template_path.relative_to(course_dir))
             )
@@ -235,6 +381,14 @@ def create_template_dir(config, assignment, mode="fail"):
                 " course; will keep directory but overwrite existing files "
                 "with same names".format(template_path.relative_to(course_dir))
             )
+        elif mode == "sync":
+            print(
+                "The directory specified: {} already exists for this"
+                " course; will update changed files and remove files that "
+                "are no longer in the assignment".format(
+                    template_path.relative_to(course_dir)
+                )
+            )
         else:
             # mode == delete
             print(
@@ -244,14 +398,20 @@ def create_template_dir(config, assignment, mode="fail"):
                     template_path.relative_to(course_dir)
                 )
             )
-            # Temporarily move the .git dir to the parent of the
-            # template_path (i.e. the template_repos dir in the config)
+            # Temporarily move the .git dir to a new directory in the parent
+            # of the template_path (i.e. the template_repos dir in the
+            # config); other templates may be doing the same at once
             # We do this to avoid issues if the local repo has already been
             # pushed to github (if we re-create a new repo, will get error
             # about unrelated histories when pushing)
             gitdir = Path(template_path, ".git")
             if gitdir.exists():
-                target = Path(Path(template_path).parent, ".tempgit")
+                tempdir = tempfile.mkdtemp(
+                    prefix=".{}.".format(template_path.name),
+                    suffix=".tempgit",
+                    dir=Path(template_path).parent,
+                )
+                target = Path(tempdir, ".git")
                 gitdir.replace(target)
 
                 # remove template_path and re-create with same name
@@ -260,6 +420,7 @@ def create_template_dir(config, assignment, mode="fail"):
 
                 # and then move the .git dir back
                 target.replace(gitdir)
+                os.rmdir(tempdir)
             else:
                 # remove template_path and re-create with same name
                 shutil.rmtree(template_path)
@@ -280,19 +441,26 @@ def copy_files_to_template_repo(
     name.
 
     Excludes files and directories that match patterns in files_to_ignore.
+
+    config can be a config.CourseConfig or a config dict from get_config().
     """
 
     # get config options
-    files_to_ignore = cf.get_config_option(config, "files_to_ignore", False)
-    course_dir = cf.get_config_option(config, "course_directory", True)
+    config = cf.course_config(config)
+    files_to_ignore = config.files_to_ignore
+    copy_method = config.copy_method
 
     # copy assignment-specific files
-    utils.copy_files(release_path, template_repo_path, files_to_ignore)
+    utils.copy_files(
+        release_path, template_repo_path, files_to_ignore, copy_method
+    )
 
     # copy extra_files
-    extra_files_path = Path(course_dir, "extra_files")
+    extra_files_path = config.extra_files_dir
     try:
-        utils.copy_files(extra_files_path, template_repo_path, files_to_ignore)
+        utils.copy_files(
+            extra_files_path, template_repo_path, files_to_ignore, copy_method
+        )
         # and add the assignment name to the readme, if it exists
         readme_path = Path(template_repo_path, "README.md")
         if readme_path.exists():
@@ -302,6 +470,112 @@ def copy_files_to_template_repo(
         pass
 
 
+def sync_template_repo(config, template_repo_path, assignment, release_path):
+    """
+    Makes the files in the local template repository match the files for
+    the assignment in release_dir and extra_files (the files that
+    copy_files_to_template_repo would copy), without rewriting files that
+    have not changed. Copies new and changed files, and deletes files (and
+    then empty directories) that are not in either source. The .git
+    directory is left alone.
+
+    Excludes files and directories that match patterns in files_to_ignore.
+
+    Returns a tuple with the number of files copied, unchanged and deleted.
+
+    config can be a config.CourseConfig or a config dict from get_config().
+    """
+    config = cf.course_config(config)
+    files_to_ignore = config.files_to_ignore
+    copy_method = config.copy_method
+
+    # the source of each file in the template, by relative path; files in
+    # extra_files take precedence, as they are copied last
+    sources = _list_files(release_path, files_to_ignore)
+    extra_files_path = config.extra_files_dir
+    has_extra_files = extra_files_path.is_dir()
+    if has_extra_files:
+        sources.update(_list_files(extra_files_path, files_to_ignore))
+    else:
+        print("No extra_files directory found")
+
+    copied = unchanged = 0
+    for rel_path, src in sources.items():
+        dest = Path(template_repo_path, rel_path)
+        # like copy_files_to_template_repo, which adds the assignment name
+        # to the readme (wherever it came from) if there is an extra_files
+        # directory
+        if rel_path == "README.md" and has_extra_files:
+            changed = _sync_readme(src, dest, assignment)
+        elif dest.is_file() and filecmp.cmp(src, dest, shallow=True):
+            changed = False
+        else:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            utils.copy_file(src, dest, copy_method)
+            changed = True
+        if changed:
+            copied += 1
+        else:
+            unchanged += 1
+
+    deleted = 0
+    subdirs = []
+    for dirpath, dirnames, filenames in os.walk(template_repo_path):
+        rel_dir = Path(dirpath).relative_to(template_repo_path)
+        if not rel_dir.parts and ".git" in dirnames:
+            dirnames.remove(".git")
+        subdirs.extend(os.path.join(dirpath, d) for d in dirnames)
+        for name in filenames:
+            rel_path = Path(rel_dir, name).as_posix()
+            if rel_path not in sources:
+                os.remove(os.path.join(dirpath, name))
+                deleted += 1
+    # deepest first, so that directories that only held empty
+    # directories are removed too
+    for subdir in reversed(subdirs):
+        if not os.listdir(subdir):
+            os.rmdir(subdir)
+
+    print(
+        "Synced template: {} files copied, {} unchanged, {} deleted".format(
+            copied, unchanged, deleted
+        )
+    )
+    return copied, unchanged, deleted
+
+
+def _list_files(src_dir, files_to_ignore=None):
+    """Maps the relative (posix) path of every file below src_dir to its
+    full path, skipping files and directories that match files_to_ignore
+    (see utils.IgnoreMatcher)."""
+    files = {}
+    for dirpath, rel_dir, _, filenames in utils.walk_tree(
+        src_dir, files_to_ignore
+    ):
+        prefix = rel_dir + "/" if rel_dir else ""
+        for name in filenames:
+            files[prefix + name] = Path(dirpath, name)
+    return files
+
+
+def _sync_readme(src, dest, assignment):
+    """Writes the readme from src to dest with the assignment name added
+    (see add_assignment_to_readme), unless dest already has exactly that
+    content. Returns True if dest was written."""
+    with open(src) as readme:
+        lines = readme.readlines()
+    if len(lines) > 0:
+        lines[0] = "# Assignment {}\n".format(assignment)
+    try:
+        with open(dest) as existing:
+            if existing.readlines() == lines:
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    utils.write_file(dest, lines)
+    return True
+
+
 def add_assignment_to_readme(path_to_readme, assignment):
     with open(path_to_readme) as readme:
         lines = readme.readlines()
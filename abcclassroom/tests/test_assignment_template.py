@@ -66,6 +66,63 @@ def test_create_custom_commit_message(course_structure_assignment):
     assert "Custom commit" in git_return.stdout
 
 
+def test_create_all_templates(course_structure_assignment, monkeypatch):
+    """
+    Test that create_all_templates creates a template for every assignment
+    in the release directory, writes the config once, and reports
+    assignments that fail without stopping the others.
+    """
+    config, assignment_name, release_path = course_structure_assignment
+    course_dir = Path(config["course_directory"])
+    templates_dir = Path(config["template_dir"])
+    second = Path(release_path.parent, "assignment2")
+    second.mkdir()
+    Path(second, "nb.ipynb").write_text("{}")
+
+    writes = []
+    write_config = cf.write_config
+    monkeypatch.setattr(
+        cf,
+        "write_config",
+        lambda config, path: writes.append(path) or write_config(config, path),
+    )
+    results = abctemplate.create_all_templates(jobs=2)
+    assert results == {assignment_name: None, "assignment2": None}
+    for name in [assignment_name, "assignment2"]:
+        template_dir = Path(
+            course_dir, templates_dir, "{}-template".format(name)
+        )
+        assert Path(template_dir, ".git").exists()
+    assert len(writes) == 1
+    assignments = cf.get_config(course_dir)["assignments"]
+    assert sorted(assignments) == sorted([assignment_name, "assignment2"])
+
+    # mode fail refuses to touch existing templates
+    results = abctemplate.create_all_templates(jobs=2)
+    assert all("already exists" in msg for msg in results.values())
+
+    # mode delete re-creates every template, keeping each .git directory
+    for i in range(3, 13):
+        extra = Path(release_path.parent, "assignment{}".format(i))
+        extra.mkdir()
+        Path(extra, "nb.ipynb").write_text("{}")
+    stale = Path(
+        course_dir, templates_dir, "{}-template".format(assignment_name), "old"
+    )
+    stale.write_text("x")
+    abctemplate.create_all_templates(mode="merge", jobs=8)
+    results = abctemplate.create_all_templates(mode="delete", jobs=8)
+    assert all(msg is None for msg in results.values())
+    assert len(results) == 12
+    for name in results:
+        template_dir = Path(
+            course_dir, templates_dir, "{}-template".format(name)
+        )
+        assert Path(template_dir, ".git").is_dir()
+    assert not stale.exists()
+    assert not list(Path(course_dir, templates_dir).glob(".*tempgit"))
+
+
 def test_create_template_dir(course_structure_assignment):
     """
     Tests that create_template_dir with default mode "fail" creates a
@@ -188,6 +245,72 @@ def test_copy_files_to_template_repo(course_structure_assignment):
     assert Path(template_path, "subdirectory", "nestedscript.py").exists()
 
 
+def test_sync_template_repo(course_structure_assignment):
+    """
+    Test that sync mode only copies new and changed files, removes files
+    that are no longer in the assignment and leaves unchanged files and the
+    .git directory alone.
+    """
+    config, assignment_name, release_path = course_structure_assignment
+    extra_files = Path(config["course_directory"], "extra_files")
+    Path(extra_files, "README.md").write_text("# Title\nSome text\n")
+    abctemplate.create_template(assignment_name, push_to_github=False)
+    template_path = abctemplate.create_template_dir(
+        config, assignment_name, "sync"
+    )
+    unchanged = Path(template_path, "nb1.ipynb")
+    readme = Path(template_path, "README.md")
+    before = {p: p.stat().st_mtime_ns for p in [unchanged, readme]}
+
+    Path(release_path, "nb2.ipynb").write_text("changed")
+    Path(release_path, "new.ipynb").write_text("new")
+    Path(release_path, "subdirectory", "nestedscript.py").unlink()
+    Path(release_path, "subdirectory", "nesteddata.csv").unlink()
+    Path(template_path, "stale.txt").write_text("stale")
+    # an ignored file that is already in the template is removed too
+    Path(template_path, ".DS_Store").touch()
+
+    # use the same config as create_template (the one in config.yml)
+    config = cf.get_config()
+    copied, _, deleted = abctemplate.sync_template_repo(
+        config, template_path, assignment_name, release_path
+    )
+    assert copied == 2
+    assert deleted == 4
+    assert Path(template_path, "nb2.ipynb").read_text() == "changed"
+    assert Path(template_path, "new.ipynb").exists()
+    assert not Path(template_path, "stale.txt").exists()
+    assert not Path(template_path, ".DS_Store").exists()
+    assert not Path(template_path, "subdirectory").exists()
+    assert Path(template_path, ".git").is_dir()
+    for path, mtime in before.items():
+        assert path.stat().st_mtime_ns == mtime
+    assert readme.read_text().startswith(
+        "# Assignment {}".format(assignment_name)
+    )
+
+    # nothing changed since, so nothing is copied
+    copied, _, deleted = abctemplate.sync_template_repo(
+        config, template_path, assignment_name, release_path
+    )
+    assert (copied, deleted) == (0, 0)
+
+    # a readme from the release directory gets the assignment name as well,
+    # as it does when copying, as long as there is an extra_files directory
+    Path(extra_files, "README.md").unlink()
+    Path(release_path, "README.md").write_text("# Homework\nbody\n")
+    abctemplate.copy_files_to_template_repo(
+        config, template_path, assignment_name, release_path
+    )
+    expected = "# Assignment {}\nbody\n".format(assignment_name)
+    assert readme.read_text() == expected
+    copied, _, deleted = abctemplate.sync_template_repo(
+        config, template_path, assignment_name, release_path
+    )
+    assert (copied, deleted) == (0, 0)
+    assert readme.read_text() == expected
+
+
 def test_copy_files_to_template_repo_extra_files(course_structure_assignment):
     """
     Test that files and directories in the extra_files directory are
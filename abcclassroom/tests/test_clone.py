@@ -4,6 +4,8 @@ from pathlib import Path
 import pytest
 
 import abcclassroom.clone as abcclone
+import abcclassroom.config as cf
+import abcclassroom.git as abcgit
 
 
 @pytest.fixture
@@ -43,6 +45,23 @@ def test_roster_missing(sample_course_structure, tmp_path):
         abcclone.clone_repos(assignment_name, skip_existing=False)
 
 
+def test_clone_reference_template_needs_template_dir(
+    sample_course_structure, capsys
+):
+    """Test that --reference template without template_dir in the config
+    is reported before any cloning starts."""
+    course_name, config = sample_course_structure
+    disk_config = cf.get_config()
+    del disk_config["template_dir"]
+    cf.write_config(disk_config)
+    abcclone.clone_repos("test_assignment", reference="template")
+    captured = capsys.readouterr()
+    assert "template_dir" in captured.out
+    assert not Path(
+        config["course_directory"], "cloned_repos", "test_assignment"
+    ).exists()
+
+
 def test_roster_missing_github_name(sample_course_structure, capsys):
     """Test that when the roster is missing a student gh username."""
 
@@ -116,6 +135,41 @@ def test_copy_assignment_files(course_with_student_clones):
         assert Path(submitted_path, "junk.csv").exists() is False
 
 
+def test_copy_assignment_files_skips_ignored(course_with_student_clones):
+    """Test that files matching files_to_ignore (e.g. notebook checkpoints)
+    are not copied to submitted, from the working tree or from git."""
+    config, assignment_name, students = course_with_student_clones
+    config["files_to_ignore"] = [".ipynb_checkpoints"]
+    student = students[0]
+    repo_path = Path(
+        config["course_directory"],
+        config["clone_dir"],
+        assignment_name,
+        "{}-{}".format(assignment_name, student),
+    )
+    Path(repo_path, "nb1.ipynb").write_text("real work")
+    Path(repo_path, ".ipynb_checkpoints").mkdir()
+    Path(repo_path, ".ipynb_checkpoints", "nb1.ipynb").write_text("old")
+    submitted_file = Path(
+        config["course_directory"],
+        config["course_materials"],
+        "submitted",
+        student,
+        assignment_name,
+        "nb1.ipynb",
+    )
+
+    abcclone.copy_assignment_files(config, student, assignment_name)
+    assert submitted_file.read_text() == "real work"
+
+    submitted_file.unlink()
+    abcgit.init_and_commit(repo_path, "student work")
+    abcclone.copy_assignment_files(
+        config, student, assignment_name, from_git=True
+    )
+    assert submitted_file.read_text() == "real work"
+
+
 def test_files_to_grade_empty(course_with_student_clones):
     """Test that when files to grade list is empty, only ipynb files are
     moved to the submitted dir."""
@@ -162,3 +216,202 @@ def test_copy_assignment_files_optional_files(course_with_student_clones):
             assert Path(student_submitted, file).exists()
         # It should not move the csv file in this case
         assert Path(student_submitted, "junk.csv").exists() is False
+
+
+def test_clone_repos_parallel_summary(
+    sample_course_structure, monkeypatch, capsys
+):
+    """Test that running clones in parallel still reports failed repos
+    in roster order."""
+    course_name, config = sample_course_structure
+    assignment_name = "test_assignment"
+    calls = []
+
+    def fake_clone_or_update(organization, repo, clone_dir, *args):
+        calls.append(repo)
+        if repo.endswith("username1"):
+            return "failed"
+        return "cloned"
+
+    monkeypatch.setattr(abcclone, "clone_or_update_repo", fake_clone_or_update)
+    abcclone.clone_repos(assignment_name, no_submitted=False, jobs=4)
+
+    captured = capsys.readouterr()
+    assert sorted(calls) == [
+        "test_assignment-username1",
+        "test_assignment-username2",
+    ]
+    assert "Could not clone or update the following repos" in captured.out
+    assert " test_assignment-username1" in captured.out
+    assert " test_assignment-username2" not in captured.out
+
+
+def test_clone_or_update_skips_unchanged_repo(tmp_path, monkeypatch):
+    """Test that an existing repo is only pulled when the commit on GitHub
+    differs from the one recorded on the last run."""
+    repo = "assignment1-bert"
+    Path(tmp_path, repo).mkdir()
+    pulls = []
+    monkeypatch.setattr(
+        abcclone.abcgit, "remote_head", lambda org, repo: "abc123"
+    )
+    monkeypatch.setattr(
+        abcclone.abcgit, "pull_from_github", lambda d: pulls.append(d)
+    )
+
+    remote_heads = {}
+    result = abcclone.clone_or_update_repo(
+        "org", repo, tmp_path, False, remote_heads
+    )
+    assert result == "updated"
+    assert remote_heads[repo] == "abc123"
+    assert len(pulls) == 1
+
+    result = abcclone.clone_or_update_repo(
+        "org", repo, tmp_path, False, remote_heads
+    )
+    assert result == "unchanged"
+    assert len(pulls) == 1
+
+
+def test_copy_assignment_files_only_copies_changes(
+    course_with_student_clones,
+):
+    """Test that running copy_assignment_files again leaves unchanged files
+    alone and only copies files that changed."""
+    config, assignment_name, students = course_with_student_clones
+    student = students[0]
+    course_dir = config["course_directory"]
+    repo_path = Path(
+        course_dir,
+        config["clone_dir"],
+        assignment_name,
+        "{}-{}".format(assignment_name, student),
+    )
+    submitted_path = Path(
+        course_dir,
+        config["course_materials"],
+        "submitted",
+        student,
+        assignment_name,
+    )
+
+    abcclone.copy_assignment_files(config, student, assignment_name)
+    nb1_mtime = Path(submitted_path, "nb1.ipynb").stat().st_mtime_ns
+
+    # touch one file without changing it, and change another
+    Path(repo_path, "nb1.ipynb").touch()
+    Path(repo_path, "nb2.ipynb").write_text("{}")
+    abcclone.copy_assignment_files(config, student, assignment_name)
+
+    assert Path(submitted_path, "nb1.ipynb").stat().st_mtime_ns == nb1_mtime
+    assert Path(submitted_path, "nb2.ipynb").read_text() == "{}"
+
+
+def test_copy_assignment_files_from_git(course_with_student_clones, capsys):
+    """Test that copying files from the git objects gives the same result
+    as copying from the working tree, and skips files that did not change
+    on the next run."""
+    config, assignment_name, students = course_with_student_clones
+    student = students[0]
+    course_dir = config["course_directory"]
+    repo_path = Path(
+        course_dir,
+        config["clone_dir"],
+        assignment_name,
+        "{}-{}".format(assignment_name, student),
+    )
+    Path(repo_path, "nb1.ipynb").write_text('{"cells": []}')
+    abcgit.init_and_commit(repo_path, "student work")
+    submitted_path = Path(
+        course_dir,
+        config["course_materials"],
+        "submitted",
+        student,
+        assignment_name,
+    )
+
+    abcclone.copy_assignment_files(
+        config, student, assignment_name, from_git=True
+    )
+    for f in ["nb1.ipynb", "nb2.ipynb", "script.py", "nestedscript.py"]:
+        assert Path(submitted_path, f).exists()
+    assert Path(submitted_path, "junk.csv").exists() is False
+    assert Path(submitted_path, "nb1.ipynb").read_text() == '{"cells": []}'
+
+    capsys.readouterr()
+    abcclone.copy_assignment_files(
+        config, student, assignment_name, from_git=True
+    )
+    assert "Copied 0 new or changed files" in capsys.readouterr().out
+
+
+def test_clone_repos_skips_students_without_repo(
+    sample_course_structure, monkeypatch, capsys
+):
+    """Test that with skip_missing, git is not run for students whose repo
+    is not listed on GitHub, and that we fall back to cloning every repo if
+    listing fails or lists none of the students' repos."""
+    course_name, config = sample_course_structure
+    assignment_name = "test_assignment"
+    calls = []
+
+    def fake_clone_or_update(organization, repo, clone_dir, *args):
+        calls.append(repo)
+        return "cloned"
+
+    monkeypatch.setattr(abcclone, "clone_or_update_repo", fake_clone_or_update)
+    monkeypatch.setattr(
+        abcclone.auth, "get_github_auth", lambda: {"access_token": "abc"}
+    )
+    monkeypatch.setattr(
+        abcclone.abcgithub,
+        "list_assignment_repos",
+        lambda org, assignment, token: {"test_assignment-username2"},
+    )
+    everyone = ["test_assignment-username1", "test_assignment-username2"]
+    # without skip_missing, the listing is not used
+    abcclone.clone_repos(assignment_name, no_submitted=False)
+    assert sorted(calls) == everyone
+
+    calls.clear()
+    capsys.readouterr()
+    abcclone.clone_repos(
+        assignment_name, no_submitted=False, skip_missing=True
+    )
+    captured = capsys.readouterr()
+    assert calls == ["test_assignment-username2"]
+    assert "1 students have no repository" in captured.out
+    assert " test_assignment-username1" in captured.out
+
+    def failed_listing(org, assignment, token):
+        raise ConnectionError("no network")
+
+    calls.clear()
+    monkeypatch.setattr(
+        abcclone.abcgithub, "list_assignment_repos", failed_listing
+    )
+    abcclone.clone_repos(
+        assignment_name, no_submitted=False, skip_missing=True
+    )
+    captured = capsys.readouterr()
+    assert "Could not list the repositories" in captured.out
+    assert sorted(calls) == [
+        "test_assignment-username1",
+        "test_assignment-username2",
+    ]
+
+    # a listing that has none of the students' repos (e.g. the GitHub App
+    # can only see some repositories in the organization) is not trusted
+    calls.clear()
+    monkeypatch.setattr(
+        abcclone.abcgithub,
+        "list_assignment_repos",
+        lambda org, assignment, token: {"test_assignment-someone-else"},
+    )
+    abcclone.clone_repos(
+        assignment_name, no_submitted=False, skip_missing=True
+    )
+    captured = capsys.readouterr()
+    assert "trying to clone all of them" in captured.out
+    assert sorted(calls) == everyone
@@ -64,6 +64,41 @@ def test_write_config(default_config, tmp_path):
     assert Path(testpath, "config.yml").exists()
 
 
+def test_get_config_is_cached(default_config, tmp_path, monkeypatch):
+    """Test that an unchanged config file is only parsed once, and that
+    callers get their own copy of it."""
+    abcconfig.write_config(default_config, configpath=tmp_path)
+    loads = []
+    real_yaml = abcconfig.YAML
+
+    def counting_yaml():
+        yaml = real_yaml()
+        load = yaml.load
+        yaml.load = lambda f: loads.append(f) or load(f)
+        return yaml
+
+    monkeypatch.setattr(abcconfig, "YAML", counting_yaml)
+    config = abcconfig.get_config(configpath=tmp_path)
+    config["template_dir"] = "changed"
+    again = abcconfig.get_config(configpath=tmp_path)
+    assert len(loads) == 1
+    assert again == default_config
+
+
+def test_get_config_cache_invalidated(default_config, tmp_path):
+    """Test that the cache notices changes to the file, whether made by
+    write_config or by something else."""
+    abcconfig.write_config(default_config, configpath=tmp_path)
+    config = abcconfig.get_config(configpath=tmp_path)
+    config["pie"] = "apple"
+    abcconfig.write_config(config, configpath=tmp_path)
+    assert abcconfig.get_config(configpath=tmp_path)["pie"] == "apple"
+
+    with open(Path(tmp_path, "config.yml"), "a") as f:
+        f.write("cake: lemon\n")
+    assert abcconfig.get_config(configpath=tmp_path)["cake"] == "lemon"
+
+
 def test_get_config_option(default_config):
     # test that works in basic get existing option cases
     assert (
@@ -141,3 +176,48 @@ def test_set_config_option(default_config, tmp_path):
     )
     assert len(abcconfig.get_config_option(config, "pie")) == 2
     assert "sugar" in abcconfig.get_config_option(config, "pie")
+
+
+def test_course_config(default_config, tmp_path):
+    """Test that CourseConfig resolves paths against the course directory
+    and fills in defaults."""
+    default_config["course_directory"] = str(tmp_path)
+    default_config["template_dir"] = "/templates"
+    config = abcconfig.CourseConfig(default_config)
+    assert config.clone_dir == Path(tmp_path, "cloned_repos")
+    assert config.template_dir == Path("/templates")
+    assert config.submitted_path("bert", "a1") == Path(
+        tmp_path, "nbgrader", "submitted", "bert", "a1"
+    )
+    assert config.repo_path("a1", "bert") == Path(
+        tmp_path, "cloned_repos", "a1", "a1-bert"
+    )
+    assert config.template_path("a1") == Path("/templates", "a1-template")
+    assert config.roster is None
+    assert config.copy_method == "auto"
+    assert config.clone_strategy == "full"
+    assert config.ssh_multiplexing is True
+    assert config.skip_missing_repos is False
+    assert config.ignore.match("junk.csv")
+    assert abcconfig.course_config(config) is config
+
+
+def test_course_config_invalid(default_config, tmp_path):
+    """Test that missing and invalid options are reported up front."""
+    with pytest.raises(KeyError, match="course_directory"):
+        abcconfig.CourseConfig(default_config)
+    default_config["course_directory"] = str(tmp_path)
+    with pytest.raises(KeyError, match="roster"):
+        abcconfig.CourseConfig(default_config, required=("roster",))
+    default_config["copy_method"] = "teleport"
+    with pytest.raises(ValueError, match="copy_method"):
+        abcconfig.CourseConfig(default_config)
+    default_config["copy_method"] = "copy"
+    default_config["clone_reference"] = "template"
+    del default_config["template_dir"]
+    with pytest.raises(KeyError, match="template_dir"):
+        abcconfig.CourseConfig(default_config)
+    default_config["clone_reference"] = "none"
+    default_config["files_to_grade"] = {".py": True}
+    with pytest.raises(ValueError, match="files_to_grade"):
+        abcconfig.CourseConfig(default_config)
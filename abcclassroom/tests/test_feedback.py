@@ -1,3 +1,177 @@
+# Tests for feedback script
+from pathlib import Path
+
+import pytest
+
+import abcclassroom.config as cf
+import abcclassroom.feedback as abcfeedback
+import abcclassroom.git as abcgit
+
+
+@pytest.fixture
+def course_with_feedback(course_with_student_clones):
+    """
+    Turns the student clones into git repositories, writes a roster for
+    the students and creates a feedback report for each of them.
+    """
+    config, assignment_name, students = course_with_student_clones
+    course_dir = Path(config["course_directory"])
+    roster_lines = ['"identifier","github_username","github_id","name"']
+    for s in students:
+        roster_lines.append('"{0}","{0}","1","{0}"'.format(s))
+        repo_path = Path(
+            course_dir,
+            config["clone_dir"],
+            assignment_name,
+            "{}-{}".format(assignment_name, s),
+        )
+        abcgit.init_and_commit(repo_path, "student work")
+        feedback_path = Path(
+            course_dir,
+            config["course_materials"],
+            "feedback",
+            s,
+            assignment_name,
+        )
+        feedback_path.mkdir(parents=True)
+        Path(feedback_path, "{}.html".format(assignment_name)).write_text(
+            "<html>Nice work {}</html>".format(s)
+        )
+    Path(course_dir, "classroom_roster.csv").write_text(
+        "\n".join(roster_lines) + "\n"
+    )
+    return config, assignment_name, students
+
+
+def test_copy_feedback_files_parallel_push(
+    course_with_feedback, monkeypatch, capsys
+):
+    """Test that feedback is committed for every student, pushes run for
+    each repo and failed pushes show up in the final report."""
+    config, assignment_name, students = course_with_feedback
+    pushed = []
+
+    def fake_push(directory, branch="main"):
+        pushed.append(Path(directory).name)
+        if Path(directory).name.endswith(students[0]):
+            raise RuntimeError("remote rejected")
+
+    monkeypatch.setattr(abcgit, "push_to_github", fake_push)
+    abcfeedback.copy_feedback_files(
+        assignment_name, push_to_github=True, jobs=2
+    )
+
+    assert sorted(pushed) == sorted(
+        "{}-{}".format(assignment_name, s) for s in students
+    )
+    out = capsys.readouterr().out
+    assert "1 students succeeded, 1 failed" in out
+    assert "remote rejected" in out
+    for s in students:
+        repo_path = Path(
+            config["clone_dir"],
+            assignment_name,
+            "{}-{}".format(assignment_name, s),
+        )
+        assert Path(repo_path, "{}.html".format(assignment_name)).exists()
+        assert abcgit.repo_changed(repo_path) is False
+
+
+def test_copy_feedback_files_push_error(
+    course_with_feedback, monkeypatch, capsys
+):
+    """Test that errors other than git failures in a push are reported
+    against the student, not as a missing roster."""
+    config, assignment_name, students = course_with_feedback
+
+    def fake_push(directory, branch="main"):
+        raise FileNotFoundError("No such file or directory: 'git'")
+
+    monkeypatch.setattr(abcgit, "push_to_github", fake_push)
+    abcfeedback.copy_feedback_files(assignment_name, push_to_github=True)
+    out = capsys.readouterr().out
+    assert "0 students succeeded, 2 failed" in out
+    assert "push to GitHub failed: No such file or directory" in out
+    assert "Cannot find roster file" not in out
+
+
+def test_copy_feedback_files_ignores_files(course_with_feedback):
+    """Test that feedback files matching files_to_ignore are not copied."""
+    config, assignment_name, students = course_with_feedback
+    course_dir = Path(config["course_directory"])
+    disk_config = cf.get_config(course_dir)
+    disk_config["files_to_ignore"] = ["draft-*.html"]
+    cf.write_config(disk_config, course_dir)
+    for s in students:
+        feedback_path = Path(
+            course_dir, config["course_materials"], "feedback", s
+        )
+        Path(feedback_path, assignment_name, "draft-1.html").write_text("x")
+
+    abcfeedback.copy_feedback_files(assignment_name)
+
+    for s in students:
+        repo_path = Path(
+            config["clone_dir"],
+            assignment_name,
+            "{}-{}".format(assignment_name, s),
+        )
+        assert Path(repo_path, "{}.html".format(assignment_name)).exists()
+        assert not Path(repo_path, "draft-1.html").exists()
+
+
+def test_copy_feedback_files_only_prints_report(course_with_feedback, capsys):
+    """Test that when the feedback is already committed (but not in the
+    ledger), "no changes" is only shown in the summary report."""
+    config, assignment_name, students = course_with_feedback
+    abcfeedback.copy_feedback_files(assignment_name)
+    Path(
+        config["clone_dir"], assignment_name, ".abc-classroom", "feedback.json"
+    ).unlink()
+    capsys.readouterr()
+    abcfeedback.copy_feedback_files(assignment_name)
+    out = capsys.readouterr().out
+    assert "No changes in repository" not in out
+    assert out.count("copied 1 files; no changes") == len(students)
+
+
+def test_copy_feedback_files_skips_released(
+    course_with_feedback, monkeypatch, capsys
+):
+    """Test that a second run does not run git for students whose feedback
+    was already committed and pushed, and retries failed pushes."""
+    config, assignment_name, students = course_with_feedback
+    fail_push = {students[0]}
+    pushed = []
+
+    def fake_push(directory, branch="main"):
+        student = Path(directory).name.split("-", 1)[1]
+        if student in fail_push:
+            raise RuntimeError("network down")
+        pushed.append(student)
+
+    monkeypatch.setattr(abcgit, "push_to_github", fake_push)
+    abcfeedback.copy_feedback_files(assignment_name, push_to_github=True)
+    assert pushed == [students[1]]
+
+    # second run: only the failed push is retried, and nothing is committed
+    fail_push.clear()
+    commits = []
+    monkeypatch.setattr(
+        abcgit, "commit_all_changes", lambda *a, **k: commits.append(a)
+    )
+    capsys.readouterr()
+    abcfeedback.copy_feedback_files(assignment_name, push_to_github=True)
+    assert pushed == [students[1], students[0]]
+    assert commits == []
+    out = capsys.readouterr().out
+    assert "feedback already released" in out
+
+    # third run: nothing left to do
+    abcfeedback.copy_feedback_files(assignment_name, push_to_github=True)
+    assert pushed == [students[1], students[0]]
+
+
 # from pathlib import Path
 #
 # import abcclassroom.feedback as abcfeedback
@@ -1,7 +1,12 @@
 # Tests for git and github methods
+import os
 from pathlib import Path
 
+import pytest
+
 import abcclassroom.git as abcgit
+import abcclassroom.github as abcgithub
+import abcclassroom.utils as abcutils
 
 
 def test_init_and_commit(default_config, tmp_path):
@@ -59,3 +64,255 @@ def test_master_branch_to_main_no_commits(tmp_path):
     repo_dir.mkdir()
     abcgit.git_init(repo_dir)
     abcgit._master_branch_to_main(repo_dir)
+
+
+def test_check_git_ssh_runs_once(monkeypatch):
+    """
+    Tests that a successful ssh check is remembered, and that we can
+    force a new check.
+    """
+    calls = []
+
+    def fake_ssh_check():
+        calls.append(1)
+        return True
+
+    monkeypatch.setattr(abcgit, "_run_ssh_check", fake_ssh_check)
+    abcgit.reset_git_ssh_check()
+    abcgit.check_git_ssh()
+    abcgit.check_git_ssh()
+    assert len(calls) == 1
+
+    abcgit.check_git_ssh(force=True)
+    assert len(calls) == 2
+
+    # an expired check is re-run
+    abcgit.check_git_ssh(ttl=0)
+    assert len(calls) == 3
+    abcgit.reset_git_ssh_check()
+
+
+def test_check_git_ssh_failure_not_remembered(monkeypatch):
+    """
+    Tests that a failed ssh check is run again on the next call.
+    """
+    calls = []
+
+    def fake_ssh_check():
+        calls.append(1)
+        raise RuntimeError("Permission denied (publickey).")
+
+    monkeypatch.setattr(abcgit, "_run_ssh_check", fake_ssh_check)
+    abcgit.reset_git_ssh_check()
+    for i in range(2):
+        with pytest.raises(RuntimeError):
+            abcgit.check_git_ssh()
+    assert len(calls) == 2
+
+
+@pytest.mark.skipif(os.name == "nt", reason="ssh sharing not on Windows")
+def test_ssh_connection_sharing_sets_git_ssh_command(monkeypatch):
+    """
+    Tests that git commands get a GIT_SSH_COMMAND that uses a shared
+    ssh connection only inside the ssh_connection_sharing block.
+    """
+    monkeypatch.delenv("GIT_SSH_COMMAND", raising=False)
+    monkeypatch.delenv("GIT_SSH", raising=False)
+    assert abcgit._git_env() is None
+    with abcgit.ssh_connection_sharing():
+        env = abcgit._git_env()
+        assert "ControlMaster=auto" in env["GIT_SSH_COMMAND"]
+    assert abcgit._git_env() is None
+
+    with abcgit.ssh_connection_sharing(enabled=False):
+        assert abcgit._git_env() is None
+
+
+@pytest.mark.skipif(os.name == "nt", reason="ssh sharing not on Windows")
+def test_ssh_connection_sharing_keeps_core_ssh_command(tmp_path, monkeypatch):
+    """
+    Tests that the ssh command set with core.sshCommand in the git config
+    (e.g. to pick a key for GitHub) is still used with a shared connection,
+    as GIT_SSH_COMMAND takes precedence over it.
+    """
+    monkeypatch.delenv("GIT_SSH_COMMAND", raising=False)
+    monkeypatch.delenv("GIT_SSH", raising=False)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.delenv("XDG_CONFIG_HOME", raising=False)
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    Path(tmp_path, ".gitconfig").write_text(
+        "[core]\n\tsshCommand = ssh -i ~/.ssh/github_key\n"
+    )
+    with abcgit.ssh_connection_sharing():
+        env = abcgit._git_env(tmp_path)
+        assert env["GIT_SSH_COMMAND"].startswith("ssh -i ~/.ssh/github_key ")
+        assert "ControlMaster=auto" in env["GIT_SSH_COMMAND"]
+
+
+@pytest.fixture
+def remote_repo(tmp_path, monkeypatch):
+    """
+    Creates a bare repository (standing in for a repo on GitHub) with a
+    notebook, a script and a data file, and points clone_repo at it.
+    """
+    source = Path(tmp_path, "source")
+    source.mkdir()
+    Path(source, "nb1.ipynb").write_text("{}")
+    Path(source, "data").mkdir()
+    Path(source, "data", "junk.csv").write_text("1,2,3")
+    abcgit.init_and_commit(source, "first commit")
+    remote = Path(tmp_path, "remote.git")
+    abcgit._call_git("clone", "--bare", str(source), str(remote))
+    abcgit._call_git("remote", "add", "origin", str(remote), directory=source)
+
+    monkeypatch.setattr(
+        abcgit, "_github_url", lambda org, repo: remote.as_uri()
+    )
+    monkeypatch.setattr(abcgit, "_run_ssh_check", lambda: True)
+    abcgit.reset_git_ssh_check()
+    return source
+
+
+@pytest.mark.parametrize("strategy", abcgit.CLONE_STRATEGIES)
+def test_clone_strategies(remote_repo, tmp_path, strategy):
+    """
+    Tests that each clone strategy checks out the expected files, and
+    that we can still pull new commits afterwards.
+    """
+    dest = Path(tmp_path, strategy)
+    dest.mkdir()
+    abcgit.clone_repo(
+        "org", "remote", dest, strategy, sparse_patterns=["*.ipynb"]
+    )
+    repo_dir = Path(dest, "remote")
+    assert Path(repo_dir, "nb1.ipynb").exists()
+    assert Path(repo_dir, "data", "junk.csv").exists() == (
+        strategy != "sparse"
+    )
+
+    Path(remote_repo, "nb2.ipynb").write_text("{}")
+    abcgit.commit_all_changes(remote_repo, msg="second commit")
+    abcgit._call_git("push", "origin", "main", directory=remote_repo)
+    abcgit.pull_from_github(repo_dir)
+    assert Path(repo_dir, "nb2.ipynb").exists()
+
+
+def test_clone_with_reference(remote_repo, tmp_path):
+    """
+    Tests that cloning with a reference repository borrows objects from it
+    rather than storing its own copy, using a local mirror as reference.
+    """
+    mirror = Path(tmp_path, "mirror.git")
+    abcgit.update_mirror("org", "remote", mirror)
+    assert Path(mirror, "objects").is_dir()
+    # updating an existing mirror fetches rather than cloning again
+    abcgit.update_mirror("org", "remote", mirror)
+
+    dest = Path(tmp_path, "clones")
+    dest.mkdir()
+    abcgit.clone_repo("org", "remote", dest, reference=mirror)
+    alternates = Path(dest, "remote", ".git", "objects", "info", "alternates")
+    assert alternates.exists()
+    assert str(mirror) in alternates.read_text()
+
+
+@pytest.mark.parametrize("backend", ["subprocess", "dulwich"])
+def test_git_backends(tmp_path, backend):
+    """
+    Tests that each git backend can initialize a repo, commit new, changed
+    and deleted files and rename the master branch to main, with the same
+    result as the git command line.
+    """
+    if backend == "dulwich":
+        pytest.importorskip("dulwich")
+    repo_dir = Path(tmp_path, "backend-repo")
+    repo_dir.mkdir()
+    # start from a repo with a commit on master, as made by older versions
+    # of git
+    abcgit._call_git("init", directory=repo_dir)
+    abcgit._call_git("checkout", "-b", "master", directory=repo_dir)
+    Path(repo_dir, "keep.txt").write_text("keep")
+    Path(repo_dir, "remove.txt").write_text("remove")
+    abcgit._call_git("add", ".", directory=repo_dir)
+    abcgit._call_git("commit", "-m", "first", directory=repo_dir)
+
+    with abcgit.use_git_backend(backend) as git_backend:
+        assert git_backend.name == backend
+        abcgit.init_and_commit(repo_dir, "nothing to commit")
+        assert not abcgit.repo_changed(repo_dir)
+        assert git_backend.branch_exists(repo_dir, "main")
+        assert not git_backend.branch_exists(repo_dir, "master")
+
+        Path(repo_dir, "keep.txt").write_text("changed")
+        Path(repo_dir, "remove.txt").unlink()
+        Path(repo_dir, "subdir").mkdir()
+        Path(repo_dir, "subdir", "new.txt").write_text("new")
+        assert abcgit.repo_changed(repo_dir)
+        assert abcgit.commit_all_changes(repo_dir, "second")
+        assert not abcgit.repo_changed(repo_dir)
+        head = abcgit.head_commit(repo_dir)
+
+    # check the result with the git command line
+    assert abcgit._backend["current"].name == "subprocess"
+    assert abcgit.head_commit(repo_dir) == head
+    ret = abcgit._call_git("status", "--porcelain", directory=repo_dir)
+    assert ret.stdout == ""
+    ret = abcgit._call_git("ls-files", directory=repo_dir)
+    assert ret.stdout.split() == ["keep.txt", "subdir/new.txt"]
+    ret = abcgit._call_git("symbolic-ref", "HEAD", directory=repo_dir)
+    assert ret.stdout.strip() == "refs/heads/main"
+
+
+def test_unknown_git_backend():
+    with pytest.raises(ValueError, match="Unknown git backend"):
+        with abcgit.use_git_backend("svn"):
+            pass
+
+
+def test_object_info_uses_persistent_process(tmp_path, monkeypatch):
+    """
+    Tests that ref and object queries are answered by one cat-file process
+    per repository, that they see later changes to the repository, and that
+    the number of open processes is capped.
+    """
+    monkeypatch.setattr(abcgit, "CAT_FILE_POOL_SIZE", 2)
+    abcgit.close_cat_file_processes()
+    repo_dir = Path(tmp_path, "probe-repo")
+    repo_dir.mkdir()
+    # queries in a directory that is not yet a repository find nothing
+    assert abcgit.object_info(repo_dir, "HEAD") is None
+
+    abcgit.git_init(repo_dir)
+    assert not abcgit.ref_exists(repo_dir, "refs/heads/main")
+    process = abcgit._cat_file_process(repo_dir)
+    Path(repo_dir, "testfile.txt").write_text("Some text")
+    abcgit.commit_all_changes(repo_dir, "first")
+    abcgit._master_branch_to_main(repo_dir)
+    assert abcgit.ref_exists(repo_dir, "refs/heads/main")
+    head = abcgit.head_commit(repo_dir)
+    assert abcgit.object_info(repo_dir, head) == (head, "commit")
+    assert abcgit._cat_file_process(repo_dir) is process
+
+    # opening processes for more repositories closes the oldest one
+    for name in ["other1", "other2"]:
+        other = Path(tmp_path, name)
+        other.mkdir()
+        abcgit.git_init(other)
+        abcgit.ref_exists(other, "refs/heads/main")
+    assert len(abcgit._cat_file_pool) == 2
+    assert str(repo_dir) not in abcgit._cat_file_pool
+    assert process.proc.poll() is not None
+    assert abcgit.ref_exists(repo_dir, "refs/heads/main")
+    abcgit.close_cat_file_processes()
+    assert not abcgit._cat_file_pool
+
+
+def test_github_client_shared_by_token():
+    """Test that github3 clients are reused for the same token and use the
+    shared pool of connections."""
+    client = abcgithub.get_client("abc")
+    assert abcgithub.get_client("abc") is client
+    assert abcgithub.get_client("def") is not client
+    assert abcgithub.get_client(None) is None
+    adapter = client.session.get_adapter("https://api.github.com")
+    assert adapter is abcutils.get_http_adapter()
@@ -0,0 +1,105 @@
+# Tests for the GitHub API cache
+
+import os
+
+import pytest
+import requests
+import requests.adapters
+
+import abcclassroom.httpcache as httpcache
+
+
+class FakeGitHub:
+    """Stands in for the network: answers GET requests with an ETag, and
+    with 304 Not Modified if the request has the current ETag."""
+
+    def __init__(self):
+        self.etag = '"v1"'
+        self.body = b'{"login": "bert"}'
+        self.requests = []
+
+    def send(self, request, stream=False, **kwargs):
+        self.requests.append(request)
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = "utf-8"
+        response.headers["ETag"] = self.etag
+        response.headers["X-RateLimit-Remaining"] = str(
+            5000 - len(self.requests)
+        )
+        if request.headers.get("If-None-Match") == self.etag:
+            response.status_code = 304
+            response._content = b""
+        else:
+            response.status_code = 200
+            response._content = self.body
+        return response
+
+
+@pytest.fixture
+def fake_github(monkeypatch):
+    fake = FakeGitHub()
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", fake.send)
+    return fake
+
+
+def _session(adapter, token):
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.headers["Authorization"] = "token {}".format(token)
+    return session
+
+
+def test_conditional_requests(fake_github, tmp_path):
+    """Test that a cached response is sent back with If-None-Match and
+    served from the cache when GitHub answers 304."""
+    adapter = httpcache.CachingAdapter(cache_dir=tmp_path)
+    session = _session(adapter, "abc")
+    url = "https://api.github.com/user"
+
+    first = session.get(url)
+    assert first.json() == {"login": "bert"}
+    assert "If-None-Match" not in fake_github.requests[0].headers
+
+    second = session.get(url)
+    assert fake_github.requests[1].headers["If-None-Match"] == '"v1"'
+    assert second.status_code == 200
+    assert second.json() == {"login": "bert"}
+    assert second.from_cache
+    # headers from the 304 response replace the cached ones
+    assert second.headers["X-RateLimit-Remaining"] == "4998"
+    assert (adapter.hits, adapter.misses) == (1, 1)
+
+    # a new version on GitHub replaces the cached one
+    fake_github.etag = '"v2"'
+    fake_github.body = b'{"login": "ernie"}'
+    assert session.get(url).json() == {"login": "ernie"}
+    assert session.get(url).from_cache
+
+    # other tokens do not share cache entries
+    _session(adapter, "def").get(url)
+    assert "If-None-Match" not in fake_github.requests[-1].headers
+
+
+def test_evict(fake_github, tmp_path):
+    """Test that old entries, and then the least recently used ones, are
+    removed."""
+    adapter = httpcache.CachingAdapter(cache_dir=tmp_path)
+    session = _session(adapter, "abc")
+    for name in ["a", "b", "c"]:
+        session.get("https://api.github.com/" + name)
+    entries = sorted(os.listdir(tmp_path))
+    assert len(entries) == 3
+    sizes = [os.path.getsize(os.path.join(tmp_path, e)) for e in entries]
+    for age, entry in enumerate(entries):
+        os.utime(os.path.join(tmp_path, entry), (1000 + age, 1000 + age))
+
+    adapter.max_age = float("inf")
+    adapter.max_size = sum(sizes) - 1
+    adapter.evict()
+    assert sorted(os.listdir(tmp_path)) == entries[1:]
+
+    adapter.max_age = 0
+    adapter.evict()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,174 @@
+# Tests for pacing of GitHub API requests
+
+import pytest
+import requests
+import requests.adapters
+
+import abcclassroom.ratelimit as ratelimit
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _response(status=200, remaining=4000, reset=2000, **headers):
+    response = requests.Response()
+    response.status_code = status
+    response._content = b"{}"
+    response._content_consumed = True
+    response.headers["X-RateLimit-Limit"] = "5000"
+    response.headers["X-RateLimit-Remaining"] = str(remaining)
+    response.headers["X-RateLimit-Reset"] = str(reset)
+    response.headers.update(headers)
+    return response
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def limiter(clock):
+    return ratelimit.RateLimiter(
+        min_remaining=10, max_backoff=600, clock=clock.time, sleep=clock.sleep
+    )
+
+
+def test_no_waiting_with_budget_left(limiter, clock):
+    limiter.update(_response(remaining=4000))
+    limiter.wait()
+    limiter.wait()
+    assert clock.sleeps == []
+    stats = limiter.stats()
+    assert stats["limit"] == 5000
+    assert stats["remaining"] == 4000
+    assert stats["requests"] == 2
+
+
+def test_requests_spread_out_when_budget_low(limiter, clock):
+    # 5 requests left and 100 seconds until the reset
+    limiter.update(_response(remaining=5, reset=1100))
+    limiter.wait()
+    assert clock.sleeps == [pytest.approx(20)]
+    # no requests left, so wait for the reset
+    limiter.update(_response(remaining=0, reset=1100))
+    limiter.wait()
+    assert clock.now == pytest.approx(1100)
+    assert limiter.stats()["waited"] == pytest.approx(100)
+
+
+def test_long_waits_are_announced(limiter, clock, capsys):
+    """Test that a long wait for the reset is printed once, and short waits
+    are not printed."""
+    limiter.update(_response(remaining=5, reset=1010))
+    limiter.wait()
+    assert capsys.readouterr().out == ""
+    limiter.update(_response(remaining=0, reset=int(clock.now) + 2400))
+    limiter.wait()
+    limiter.wait()
+    out = capsys.readouterr().out
+    assert out.count("waiting 2400 seconds") == 1
+
+
+def test_retry_delay(limiter, clock):
+    assert limiter.retry_delay(_response(200), 0) is None
+    assert limiter.retry_delay(_response(404), 0) is None
+    # secondary rate limit with Retry-After
+    delay = limiter.retry_delay(_response(403, **{"Retry-After": "30"}), 0)
+    assert 30 <= delay <= 30 * 1.25
+    # primary rate limit: wait until the reset
+    limiter.update(_response(403, remaining=0, reset=1200))
+    delay = limiter.retry_delay(_response(403, remaining=0, reset=1200), 0)
+    assert 200 <= delay <= 200 * 1.25
+    # no information, so back off exponentially
+    delay = limiter.retry_delay(_response(429), 3)
+    assert 8 <= delay <= 8 * 1.25
+    assert limiter.retry_delay(_response(429), limiter.max_retries) is None
+    assert limiter.stats()["retries"] == 3
+
+
+def test_adapter_retries_rate_limited_requests(clock, monkeypatch):
+    """Test that the adapter retries a request that hit the secondary rate
+    limit, after waiting."""
+    responses = [
+        _response(403, **{"Retry-After": "5"}),
+        _response(200),
+    ]
+    sent = []
+
+    def fake_send(adapter, request, **kwargs):
+        sent.append(request)
+        return responses.pop(0)
+
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", fake_send)
+    limiter = ratelimit.RateLimiter(clock=clock.time, sleep=clock.sleep)
+    session = requests.Session()
+    session.mount("https://", ratelimit.RateLimitedAdapter(limiter))
+    response = session.post("https://api.github.com/orgs/org/repos")
+    assert response.status_code == 200
+    assert len(sent) == 2
+    assert len(clock.sleeps) == 1
+    assert 5 <= clock.sleeps[0] <= 5 * 1.25
+
+
+def test_waits_for_reset_when_budget_used_up(clock, monkeypatch):
+    """Test that a request waits for the reset when the budget is used up,
+    however far away it is, and then succeeds."""
+    responses = [
+        _response(403, remaining=0, reset=3400),
+        _response(200, remaining=4999, reset=7000),
+    ]
+
+    def fake_send(adapter, request, **kwargs):
+        return responses.pop(0)
+
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", fake_send)
+    limiter = ratelimit.RateLimiter(clock=clock.time, sleep=clock.sleep)
+    session = requests.Session()
+    session.mount("https://", ratelimit.RateLimitedAdapter(limiter))
+    response = session.get("https://api.github.com/orgs/org/repos")
+    assert response.status_code == 200
+    assert clock.now >= 3400
+    assert limiter.stats()["retries"] == 1
+
+
+def test_budgets_per_token_and_resource(limiter, clock):
+    """Test that a low budget for one token or resource does not slow down
+    requests that count against another."""
+    unauthenticated = (None, "core")
+    search = ("abc", "search")
+    core = ("abc", "core")
+    limiter.update(_response(remaining=0, reset=1100), search)
+    limiter.update(_response(remaining=2, reset=1100), unauthenticated)
+    limiter.update(_response(remaining=4000), core)
+    limiter.wait(core)
+    assert clock.sleeps == []
+    limiter.wait(search)
+    assert clock.sleeps == [pytest.approx(100)]
+    assert limiter.stats()["remaining"] == 0
+    assert limiter.stats()["budgets"][core]["remaining"] == 4000
+
+
+def test_budget_key():
+    request = requests.Request(
+        "GET",
+        "https://api.github.com/search/repositories?q=x",
+        headers={"Authorization": "token secret"},
+    ).prepare()
+    token_id, resource = ratelimit.budget_key(request)
+    assert resource == "search"
+    assert token_id and "secret" not in token_id
+    request.headers.pop("Authorization")
+    assert ratelimit.budget_key(request) == (None, "search")
+    response = _response(**{"X-RateLimit-Resource": "code_search"})
+    assert ratelimit.budget_key(request, response) == (None, "code_search")
@@ -0,0 +1,108 @@
+# Tests for scrubbing hidden tests from feedback reports
+from pathlib import Path
+
+import pytest
+
+import abcclassroom.scrub_feedback as abcscrub
+
+BEGIN = '<span class="c1">### BEGIN HIDDEN TESTS</span>'
+END = '<span class="c1">### END HIDDEN TESTS</span>'
+MARKER = abcscrub.SCRUBBED_MARKER.decode()
+
+
+@pytest.fixture
+def feedback_html(tmp_path):
+    """A feedback report with two hidden test blocks, one of them using a
+    single # in the markers."""
+    html = (
+        "<html><pre>visible test\n"
+        + BEGIN
+        + "\nassert answer == 42\n"
+        + END
+        + "\nmore visible\n"
+        + BEGIN.replace("###", "#")
+        + "\nassert secret\n"
+        + END.replace("###", "#")
+        + "\n</pre></html>\n"
+    )
+    path = Path(tmp_path, "feedback.html")
+    path.write_text(html)
+    return path
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 50, 1024 * 1024])
+def test_scrub_feedback(feedback_html, chunk_size):
+    """Test that hidden tests are removed, including when markers are split
+    across chunks."""
+    removed = abcscrub.scrub_feedback(feedback_html, chunk_size=chunk_size)
+    assert removed == 2
+    assert feedback_html.read_text() == (
+        "<html><pre>visible test\n\nmore visible\n\n</pre></html>\n" + MARKER
+    )
+    # no temporary files left behind
+    assert list(feedback_html.parent.iterdir()) == [feedback_html]
+
+
+def test_scrub_feedback_unterminated_block(tmp_path):
+    """Test that a begin marker without an end marker is left alone."""
+    html = "<html>" + BEGIN + "\nassert answer == 42\n</html>\n"
+    path = Path(tmp_path, "feedback.html")
+    path.write_text(html)
+    assert abcscrub.scrub_feedback(path, chunk_size=10) == 0
+    assert path.read_text() == html + MARKER
+
+
+@pytest.mark.parametrize(
+    "begin, end",
+    [
+        ('<span class="c1">#### BEGIN HIDDEN TESTS</span>', END),
+        (
+            '<span class="c">#  BEGIN HIDDEN TESTS </span>',
+            '<span class="c"># END  HIDDEN TESTS</span>',
+        ),
+        (
+            '<span class="cm">##BEGIN HIDDEN TESTS</span>',
+            '<span class="cm">##END HIDDEN TESTS</span>',
+        ),
+    ],
+)
+def test_scrub_feedback_marker_variants(tmp_path, begin, end):
+    """Test that other numbers of # signs, extra whitespace and other
+    comment classes are matched."""
+    path = Path(tmp_path, "feedback.html")
+    path.write_text("<pre>a\n" + begin + "\nsecret\n" + end + "\nb</pre>")
+    assert abcscrub.scrub_feedback(path, chunk_size=16) == 1
+    assert path.read_text() == "<pre>a\n\nb</pre>" + MARKER
+
+
+def test_scrub_feedback_skips_scrubbed_file(feedback_html):
+    """Test that scrubbing a file a second time leaves it alone."""
+    abcscrub.scrub_feedback(feedback_html)
+    assert abcscrub.is_scrubbed(feedback_html)
+    mtime = feedback_html.stat().st_mtime_ns
+    assert abcscrub.scrub_feedback(feedback_html) == 0
+    assert feedback_html.stat().st_mtime_ns == mtime
+
+
+def test_scrub_assignment(sample_course_structure):
+    """Test that scrub_assignment scrubs every report for the assignment,
+    in parallel, and skips them when run again."""
+    course_name, config = sample_course_structure
+    feedback_dir = Path(
+        config["course_directory"], config["course_materials"], "feedback"
+    )
+    reports = []
+    for student in ["bert", "alana", "ernie"]:
+        student_dir = Path(feedback_dir, student, "assignment1")
+        student_dir.mkdir(parents=True)
+        report = Path(student_dir, "assignment1.html")
+        report.write_text("<pre>" + BEGIN + "secret" + END + "</pre>")
+        reports.append(report)
+
+    removed = abcscrub.scrub_assignment("assignment1", jobs=2)
+    assert sorted(removed) == sorted(reports)
+    assert sum(removed.values()) == 3
+    for report in reports:
+        assert "secret" not in report.read_text()
+
+    assert abcscrub.scrub_assignment("assignment1", jobs=2) == {}
@@ -65,6 +65,64 @@ def test_copy_files_with_ignored(default_config, tmp_path, test_files):
     assert Path(dest_dir, "ignored").exists() is False
 
 
+@pytest.mark.parametrize("method", abcutils.COPY_METHODS)
+def test_copy_files_methods(tmp_path, test_files, method):
+    """
+    Test that every copy method copies contents, permissions and times,
+    and overwrites existing files.
+    """
+    source_dir = test_files
+    Path(source_dir, "subdir", "file3.txt").write_text("some data")
+    Path(source_dir, "subdir", "file3.txt").chmod(0o640)
+    dest_dir = Path(tmp_path, "destination")
+    Path(dest_dir, "subdir").mkdir(parents=True)
+    Path(dest_dir, "subdir", "file3.txt").write_text("old data")
+    abcutils.copy_files(source_dir, dest_dir, method=method, jobs=4)
+
+    src = Path(source_dir, "subdir", "file3.txt")
+    dest = Path(dest_dir, "subdir", "file3.txt")
+    assert dest.read_text() == "some data"
+    assert dest.stat().st_mode == src.stat().st_mode
+    assert dest.stat().st_mtime_ns == src.stat().st_mtime_ns
+    assert Path(dest_dir, "ignored", "file4.txt").exists()
+
+    # copying again over the existing copies works too
+    abcutils.copy_files(source_dir, dest_dir, method=method)
+    assert dest.read_text() == "some data"
+
+
+def test_copy_file_hardlink(tmp_path):
+    """
+    Test that hard linked copies are used when asked for, and that
+    write_file does not change the other copy.
+    """
+    src = Path(tmp_path, "src.md")
+    src.write_text("# Title\n")
+    dest = Path(tmp_path, "dest.md")
+    assert abcutils.copy_file(src, dest, "hardlink") == "hardlink"
+    assert dest.samefile(src)
+    abcutils.write_file(dest, ["# Assignment 1\n"])
+    assert src.read_text() == "# Title\n"
+    assert dest.read_text() == "# Assignment 1\n"
+
+    # other methods replace the link with a separate file
+    abcutils.copy_file(src, dest, "hardlink")
+    assert abcutils.copy_file(src, dest) in (
+        "reflink",
+        "copy_file_range",
+        "copy",
+    )
+    assert not dest.samefile(src)
+    assert dest.read_text() == "# Title\n"
+    with pytest.raises(ValueError):
+        abcutils.copy_file(src, dest, "teleport")
+
+
+def test_copy_files_missing_source(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        abcutils.copy_files(Path(tmp_path, "nothing"), tmp_path)
+
+
 def test_copy_files_combine_dirs(default_config, tmp_path, test_files):
     """
     Test that copy_files can add new files to an existing directory.
@@ -97,3 +155,113 @@ def test_copy_files_no_source_dir():
     """
     with pytest.raises(FileNotFoundError):
         abcutils.copy_files("dirthatdoesnotexist", "destination")
+
+
+def test_map_in_pool_keeps_order():
+    """
+    Test that map_in_pool returns results in the order of the inputs,
+    whether or not it runs in parallel.
+    """
+    items = list(range(20))
+    assert abcutils.map_in_pool(lambda x: x * 2, items) == [
+        x * 2 for x in items
+    ]
+    assert abcutils.map_in_pool(lambda x: x * 2, items, jobs=4) == [
+        x * 2 for x in items
+    ]
+
+
+def test_read_write_json_file(tmp_path):
+    """
+    Test that json state files round trip, and that a missing or broken
+    file reads as an empty dictionary.
+    """
+    path = Path(tmp_path, "state", "heads.json")
+    assert abcutils.read_json_file(path) == {}
+    abcutils.write_json_file(path, {"repo": "abc123"})
+    assert abcutils.read_json_file(path) == {"repo": "abc123"}
+
+    path.write_text("{not json")
+    assert abcutils.read_json_file(path) == {}
+
+
+def test_get_session_shared_by_token():
+    """Test that sessions are reused for the same token and share one pool
+    of connections."""
+    abcutils.close_sessions()
+    session = abcutils.get_session("abc")
+    assert abcutils.get_session("abc") is session
+    assert session.headers["Authorization"] == "token abc"
+    anonymous = abcutils.get_session()
+    assert anonymous is not session
+    assert "Authorization" not in anonymous.headers
+    adapter = abcutils.get_http_adapter()
+    assert session.get_adapter("https://api.github.com") is adapter
+    assert anonymous.get_adapter("https://github.com") is adapter
+    abcutils.close_sessions()
+    assert abcutils.get_session("abc") is not session
+
+
+@pytest.mark.parametrize(
+    "path, is_dir, expected",
+    [
+        (".DS_Store", False, True),
+        ("subdir/.DS_Store", False, True),
+        ("data.csv", False, True),
+        ("a/b/data.csv", False, True),
+        ("build", True, True),
+        ("build", False, False),
+        ("src/build", True, True),
+        ("data/raw", True, True),
+        ("other/data/raw", True, False),
+        ("a/b/cache", True, True),
+        ("docs/a/b/notes.tmp", False, True),
+        ("notes.tmp", False, False),
+        ("top.txt", False, True),
+        ("subdir/top.txt", False, False),
+        ("nb1.ipynb", False, False),
+    ],
+)
+def test_ignore_matcher(path, is_dir, expected):
+    """Test the gitignore-like rules of the files_to_ignore matcher."""
+    matcher = abcutils.get_ignore_matcher(
+        [
+            ".DS_Store",
+            "*.csv",
+            "build/",
+            "data/raw",
+            "**/cache",
+            "docs/**/*.tmp",
+            "/top.txt",
+        ]
+    )
+    assert matcher.match(path, is_dir) is expected
+
+
+def test_ignore_matcher_parent_dirs():
+    """Test that files inside ignored directories are ignored, and that
+    matchers are reused."""
+    matcher = abcutils.get_ignore_matcher([".ipynb_checkpoints", "build/"])
+    assert matcher is abcutils.get_ignore_matcher(
+        [".ipynb_checkpoints", "build/"]
+    )
+    assert matcher.ignored(".ipynb_checkpoints/nb1-checkpoint.ipynb")
+    assert matcher.ignored("a/build/b/script.py")
+    assert not matcher.ignored("a/build.py")
+    assert not abcutils.get_ignore_matcher(None)
+    assert not abcutils.get_ignore_matcher(None).ignored("a/b.py")
+
+
+def test_copy_file_no_ficlone_off_linux(tmp_path, monkeypatch):
+    """Test that the Linux FICLONE ioctl is not sent on other platforms,
+    where its request number means something else."""
+    fcntl = pytest.importorskip("fcntl")
+    calls = []
+    monkeypatch.setattr(fcntl, "ioctl", lambda *args: calls.append(args))
+    monkeypatch.setattr(abcutils.sys, "platform", "darwin")
+    src = Path(tmp_path, "src.txt")
+    src.write_text("data")
+    with open(src, "rb") as fsrc, open(Path(tmp_path, "dest"), "wb") as fd:
+        assert abcutils._copy_data(fsrc, fd) != "reflink"
+    assert calls == []
+    assert Path(tmp_path, "dest").read_text() == "data"
@@ -5,24 +5,48 @@ abc-classroom.utils
 """
 
 
+import errno
+import functools
+import json
 import os
+import re
 import stat
 import shutil
 import subprocess
+import sys
 import tempfile
 import textwrap
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
 
-def copy_files(src_dir, dest_dir, files_to_ignore=None):
+# Ways of copying files; see copy_file
+COPY_METHODS = ("auto", "hardlink", "copy")
+# Default number of files copied at the same time by copy_files
+COPY_JOBS = 8
+# ioctl request to make a copy-on-write clone of a file on Linux
+# (btrfs, XFS, ...); see ioctl_ficlone(2)
+_FICLONE = 0x40049409
+
+
+def copy_files(
+    src_dir, dest_dir, files_to_ignore=None, method="auto", jobs=None
+):
     """Copies contents of src_dir into dest_dir, creating dest_dir if it
     does not exist. Uses 'files_to_ignore' list to determine what not to
     copy. Copies subdirectories recursively. Overwrites existing files
-    with the same path. Implements the python 3.8 version of copytree,
-    which allows dest_dir to exits.
+    with the same path. Like the python 3.8 version of copytree, allows
+    dest_dir to exist.
+
+    The source tree is walked once (creating the destination directories
+    as it goes), and then the files are copied in a pool of threads with
+    copy_file.
 
-    Throws FileNotFoundError if src_dir does not exist.
+    Throws FileNotFoundError if src_dir does not exist, and utils.Error
+    with a list of (src, dest, reason) if any files could not be copied.
 
     Parameters
     ----------
@@ -32,39 +56,437 @@ def copy_files(src_dir, dest_dir, files_to_ignore=None):
         Directory to copy files to. Must exist.
     files_to_ignore: list
         List of file patterns to ignore.
+    method: string (default = "auto")
+        How to copy each file; one of COPY_METHODS, see copy_file.
+    jobs: int (default = None)
+        Number of files to copy at the same time. If None, uses COPY_JOBS.
+    """
+    if not os.path.isdir(src_dir):
+        raise FileNotFoundError(
+            errno.ENOENT, os.strerror(errno.ENOENT), os.fspath(src_dir)
+        )
+    if jobs is None:
+        jobs = COPY_JOBS
+
+    errors = []
+    dirs = []
+    files = []
+
+    def _walk_error(err):
+        errors.append((err.filename, None, str(err)))
+
+    for dirpath, rel_dir, dirnames, filenames in walk_tree(
+        src_dir, files_to_ignore, onerror=_walk_error
+    ):
+        dest_path = os.path.normpath(os.path.join(dest_dir, rel_dir))
+        os.makedirs(dest_path, exist_ok=True)
+        dirs.append((dirpath, dest_path))
+        for name in filenames:
+            files.append(
+                (os.path.join(dirpath, name), os.path.join(dest_path, name))
+            )
+
+    def _copy(paths):
+        try:
+            copy_file(paths[0], paths[1], method)
+        except OSError as why:
+            return (paths[0], paths[1], str(why))
+        return None
+
+    errors.extend(e for e in map_in_pool(_copy, files, jobs) if e)
+    # like copytree, copy directory permissions and times last (deepest
+    # first), once their contents are in place
+    for src_path, dest_path in reversed(dirs):
+        try:
+            shutil.copystat(src_path, dest_path)
+        except OSError as why:
+            if getattr(why, "winerror", None) is None:
+                errors.append((src_path, dest_path, str(why)))
+    if errors:
+        raise Error(errors)
+
+
+def walk_tree(src_dir, files_to_ignore=None, onerror=None):
+    """Walks the directory tree below src_dir like os.walk (following
+    symbolic links to directories), leaving out files and directories that
+    match files_to_ignore (see IgnoreMatcher). Ignored directories are not
+    entered at all.
+
+    Yields
+    ------
+    tuple
+        (dirpath, rel_dir, dirnames, filenames) for each directory, where
+        rel_dir is the path of the directory relative to src_dir (with
+        forward slashes; "" for src_dir itself).
+    """
+    matcher = get_ignore_matcher(files_to_ignore)
+    for dirpath, dirnames, filenames in os.walk(
+        src_dir, onerror=onerror, followlinks=True
+    ):
+        rel_dir = os.path.relpath(dirpath, src_dir).replace(os.sep, "/")
+        if rel_dir == ".":
+            rel_dir = ""
+        if matcher:
+            prefix = rel_dir + "/" if rel_dir else ""
+            dirnames[:] = [
+                d for d in dirnames if not matcher.match(prefix + d, True)
+            ]
+            filenames = [f for f in filenames if not matcher.match(prefix + f)]
+        yield dirpath, rel_dir, dirnames, filenames
+
+
+class IgnoreMatcher:
+    """Decides which files and directories to leave out, given a list of
+    glob patterns (the files_to_ignore option in config.yml). All of the
+    patterns are compiled into a single regular expression.
+
+    Patterns follow the rules of .gitignore files:
+
+    * A pattern without a slash (e.g. ``*.csv`` or ``.DS_Store``) matches
+      the name of a file or directory at any depth.
+    * A pattern with a slash (e.g. ``data/raw`` or ``/notes.md``) matches
+      paths relative to the top of the directory being copied.
+    * A pattern that ends with a slash (e.g. ``build/``) only matches
+      directories.
+    * ``*`` and ``?`` do not match a slash; ``**`` matches any number of
+      directories (e.g. ``**/data`` or ``data/**/*.csv``).
+    * Everything inside an ignored directory is ignored.
+
+    Paths are relative, with forward slashes.
+
+    Parameters
+    ----------
+    patterns : list of strings
+        The glob patterns.
     """
 
-    if files_to_ignore:
-        abccopytree(
-            src_dir,
-            dest_dir,
-            ignore=shutil.ignore_patterns(*files_to_ignore),
-            dirs_exist_ok=True,
+    __slots__ = ("patterns", "_any", "_dirs_only")
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns or ())
+        any_type = []
+        dirs_only = []
+        for pattern in self.patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            is_dir_pattern = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if "/" in pattern:
+                # relative to the top of the tree
+                regex = _glob_to_regex(pattern.lstrip("/"))
+            else:
+                regex = "(?:.*/)?" + _glob_to_regex(pattern)
+            if is_dir_pattern:
+                dirs_only.append(regex)
+            else:
+                any_type.append(regex)
+        self._any = _compile_alternatives(any_type)
+        self._dirs_only = _compile_alternatives(dirs_only)
+
+    def __bool__(self):
+        return self._any is not None or self._dirs_only is not None
+
+    def match(self, path, is_dir=False):
+        """Whether the file (or, if is_dir, directory) at the relative path
+        matches one of the patterns. Does not look at its parent
+        directories; see ignored."""
+        if self._any is not None and self._any.fullmatch(path):
+            return True
+        if is_dir and self._dirs_only is not None:
+            return self._dirs_only.fullmatch(path) is not None
+        return False
+
+    def ignored(self, path):
+        """Whether the file at the relative path should be left out: it, or
+        one of the directories it is in, matches one of the patterns."""
+        parts = path.split("/")
+        for i in range(1, len(parts)):
+            if self.match("/".join(parts[:i]), True):
+                return True
+        return self.match(path)
+
+
+def _compile_alternatives(regexes):
+    if not regexes:
+        return None
+    return re.compile("|".join("(?:{})".format(r) for r in regexes))
+
+
+def _glob_to_regex(glob):
+    """Translates a glob pattern (see IgnoreMatcher) into a regular
+    expression that matches a whole relative path."""
+    regex = []
+    i = 0
+    n = len(glob)
+    while i < n:
+        if glob.startswith("**/", i):
+            regex.append("(?:.*/)?")
+            i += 3
+        elif glob.startswith("/**", i) and i + 3 == n:
+            regex.append("/.*")
+            i += 3
+        elif glob.startswith("**", i):
+            regex.append(".*")
+            i += 2
+        elif glob[i] == "*":
+            regex.append("[^/]*")
+            i += 1
+        elif glob[i] == "?":
+            regex.append("[^/]")
+            i += 1
+        elif glob[i] == "[" and glob.find("]", i + 2) != -1:
+            start = i + 1
+            end = glob.find("]", i + 2)
+            chars = glob[start:end]
+            if chars[0] in "!^":
+                chars = "^" + chars[1:]
+            regex.append("[{}]".format(chars.replace("\\", "\\\\")))
+            i = end + 1
+        else:
+            regex.append(re.escape(glob[i]))
+            i += 1
+    return "".join(regex)
+
+
+@functools.lru_cache(maxsize=32)
+def _cached_matcher(patterns):
+    return IgnoreMatcher(patterns)
+
+
+def get_ignore_matcher(files_to_ignore):
+    """Returns the IgnoreMatcher for a list of patterns. Matchers are
+    compiled once and then reused for the same patterns."""
+    if isinstance(files_to_ignore, str):
+        files_to_ignore = [files_to_ignore]
+    return _cached_matcher(tuple(files_to_ignore or ()))
+
+
+def copy_file(src, dest, method="auto"):
+    """Copies the file src to dest (overwriting dest if it exists), along
+    with its permissions and modification time, like shutil.copy2.
+
+    Parameters
+    ----------
+    src : path
+        The file to copy.
+    dest : path
+        The path of the copy.
+    method : string (default = "auto")
+        One of:
+
+        * auto: make a copy-on-write clone (reflink) if the file system
+          supports it, so that no data is copied until one of the files is
+          changed; otherwise use os.copy_file_range, which lets the kernel
+          (or a network file system) copy the data; otherwise a regular copy.
+        * hardlink: make dest a hard link to src if possible, otherwise as
+          for auto. Hard linked files share their contents, so changing one
+          in place changes the other.
+        * copy: a regular copy with shutil.copy2.
+
+    Returns
+    -------
+    string
+        How the file was copied: "reflink", "copy_file_range", "hardlink"
+        or "copy".
+    """
+    if method not in COPY_METHODS:
+        raise ValueError(
+            "Unknown copy method {}; must be one of {}".format(
+                method, ", ".join(COPY_METHODS)
+            )
         )
-    else:
-        abccopytree(src_dir, dest_dir, dirs_exist_ok=True)
+    if method == "hardlink" and _hardlink(src, dest):
+        return "hardlink"
+    if os.path.islink(dest) or _same_file(src, dest):
+        # don't write through a link into another file
+        os.remove(dest)
+    if method == "copy":
+        shutil.copy2(src, dest)
+        return "copy"
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        how = _copy_data(fsrc, fdest)
+    shutil.copystat(src, dest)
+    return how
+
+
+def _same_file(src, dest):
+    try:
+        return os.path.samefile(src, dest)
+    except OSError:
+        return False
+
+
+def _hardlink(src, dest):
+    """Replaces dest with a hard link to src. Returns False if that is not
+    possible (e.g. they are on different file systems)."""
+    if _same_file(src, dest):
+        return True
+    tmp_path = "{}.{}.tmp".format(os.fspath(dest), uuid.uuid4().hex)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        return False
+    try:
+        os.replace(tmp_path, dest)
+    except OSError:
+        os.remove(tmp_path)
+        return False
+    return True
+
+
+def _copy_data(fsrc, fdest):
+    """Copies the contents of the open file fsrc to fdest with the fastest
+    method available. Returns the name of the method used."""
+    # the FICLONE request number only means this on Linux
+    if sys.platform.startswith("linux"):
+        try:
+            import fcntl
+
+            fcntl.ioctl(fdest.fileno(), _FICLONE, fsrc.fileno())
+            return "reflink"
+        except (ImportError, OSError):
+            pass
+    if hasattr(os, "copy_file_range"):
+        size = os.fstat(fsrc.fileno()).st_size
+        try:
+            copied = 0
+            while copied < size:
+                n = os.copy_file_range(
+                    fsrc.fileno(), fdest.fileno(), size - copied
+                )
+                if n == 0:
+                    break
+                copied += n
+            if copied == size:
+                return "copy_file_range"
+        except OSError:
+            pass
+        # start again from the beginning with a regular copy
+        fsrc.seek(0)
+        fdest.seek(0)
+        fdest.truncate()
+    shutil.copyfileobj(fsrc, fdest)
+    return "copy"
 
 
 class Error(OSError):
     pass
 
 
+def map_in_pool(func, items, jobs=1):
+    """Calls func on each item in items, running up to `jobs` calls at the
+    same time in a pool of worker threads. Meant for network-bound work
+    such as git clone / pull / push, where most of the time is spent
+    waiting on GitHub.
+
+    Parameters
+    ----------
+    func : callable
+        Function that takes a single item as its argument.
+    items : iterable
+        Items to process.
+    jobs : int (default = 1)
+        Maximum number of calls to run at once. With 1 (or less), items
+        are processed one at a time in the calling thread.
+
+    Returns
+    -------
+    list
+        The return values of func, in the same order as items.
+    """
+    items = list(items)
+    if jobs is None or jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(jobs, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
 # implements a simple GET request to the GitHub API url provided,
 # optionally using a token in the authentication header
 # returns the status code and response
-def get_request(url, token=None):
-    if token is None:
-        header = {
-            "Content-Type": "application/json",
-            "Accept": "application/vnd.github.v3+json",
-        }
-    else:
-        header = {
+# HTTP connections to GitHub are pooled in one adapter, which is mounted on
+# every session we use (including the github3 clients in github.py), and
+# sessions are shared by every call with the same token. See get_session.
+_http = {"adapter": None, "sessions": {}}
+_http_lock = threading.Lock()
+
+
+def get_http_adapter():
+    """Returns the HTTP adapter shared by all of the sessions used to talk
+    to GitHub, creating it on first use. It keeps a pool of open (keep-alive)
+    connections, so that API calls after the first one do not need a new
+    TLS handshake, caches API reads on disk (see httpcache.CachingAdapter)
+    and paces requests to stay within the GitHub rate limit (see
+    ratelimit.RateLimitedAdapter)."""
+    # imported here because httpcache uses the json helpers in this module
+    from .httpcache import CachingAdapter
+
+    with _http_lock:
+        if _http["adapter"] is None:
+            _http["adapter"] = CachingAdapter(
+                pool_connections=4, pool_maxsize=16
+            )
+        return _http["adapter"]
+
+
+def get_rate_limit_stats():
+    """Returns the GitHub API budget and usage counters of the shared
+    adapter (see ratelimit.RateLimiter.stats)."""
+    return get_http_adapter().rate_limiter.stats()
+
+
+def mount_http_adapter(session):
+    """Makes session use the shared pool of connections from
+    get_http_adapter for https requests."""
+    session.mount("https://", get_http_adapter())
+    return session
+
+
+def get_session(token=None):
+    """Returns a requests Session for the GitHub API. The session is created
+    on first use and then shared by every call with the same token.
+
+    Parameters
+    ----------
+    token : string (default = None)
+        GitHub access token. If given, the session sends it with every
+        request.
+    """
+    with _http_lock:
+        session = _http["sessions"].get(token)
+    if session is not None:
+        return session
+    session = requests.Session()
+    session.headers.update(
+        {
             "Content-Type": "application/json",
             "Accept": "application/vnd.github.v3+json",
-            "Authorization": "token {}".format(token),
         }
-    r = requests.get(url, headers=header)
+    )
+    if token is not None:
+        session.headers["Authorization"] = "token {}".format(token)
+    mount_http_adapter(session)
+    with _http_lock:
+        # another thread may have got here first
+        return _http["sessions"].setdefault(token, session)
+
+
+def close_sessions():
+    """Closes all of the shared sessions and their pooled connections. The
+    adapter stays usable; it opens new connections when needed."""
+    with _http_lock:
+        sessions = list(_http["sessions"].values())
+        _http["sessions"].clear()
+        adapter = _http["adapter"]
+    for session in sessions:
+        session.close()
+    if adapter is not None:
+        adapter.close()
+
+
+def get_request(url, token=None):
+    r = get_session(token).get(url)
     return (r.status_code, r.json())
 
 
@@ -215,6 +637,38 @@ def abccopytree(
     )
 
 
+def read_json_file(path):
+    """Read a json file used by abc-classroom to keep track of state between
+    runs (e.g. which commits have already been pulled). Returns an empty
+    dictionary if the file does not exist or can not be read."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return data
+
+
+def write_json_file(path, data):
+    """Write data to a json file, creating the parent directory if needed.
+    Writes to a temporary file first and then renames it, so an
+    interrupted run never leaves a half-written file behind."""
+    path = os.fspath(path)
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=parent or None, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
 def input_editor(default_message=None):
     """Ask for user input via a text editor"""
     default_message = textwrap.dedent(default_message)
@@ -251,6 +705,13 @@ def write_file(filepath, contents):
     Each item in contents is a line in the file.
     """
     # filepath = os.path.join(dir, filename)
+    try:
+        if os.stat(filepath).st_nlink > 1:
+            # don't change the contents of other hard links to this file
+            # (see copy_file)
+            os.remove(filepath)
+    except FileNotFoundError:
+        pass
     try:
         with open(filepath, "w") as f:
             for line in contents:
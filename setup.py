@@ -31,6 +31,11 @@ setup(
         "ruamel.yaml",
         "github3.py",
     ],
+    extras_require={
+        # optional in-process backend for local git operations (git_backend
+        # in config.yml)
+        "dulwich": ["dulwich"],
+    },
     classifiers=[
         "Intended Audience :: Developers",
         "License :: OSI Approved :: BSD License",
@@ -59,6 +64,7 @@ setup(
             "abc-update-template = abcclassroom.__main__:update_template",
             "abc-clone = abcclassroom.__main__:clone",
             "abc-feedback = abcclassroom.__main__:feedback",
+            "abc-scrub = abcclassroom.__main__:scrub",
             "abc-roster = abcclassroom.__main__:roster",
         ]
     },